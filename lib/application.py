@@ -6,7 +6,7 @@ import logging
 logger = logging.getLogger('synapps')
 
 import os
-from cfg import ConfigParser, NoSectionError, NoOptionError
+from cfg import ConfigParser
 import urllib, urllib2
 import json
 from distutils import version
@@ -27,10 +27,11 @@ class Application(object):
                     'Stable' : 2
                }
     
-    def __init__(self, database, infos):
+    def __init__(self, database, infos, relations=None):
         """
-            Initialisation : récupération des icônes et dépendances dans la base
-            de donnée
+            Initialisation. Les dépendances, icônes et liens ne sont récupérés
+            dans la base de donnée qu'au premier accès (sauf s'ils sont fournis
+            par relations).
            
             Arguments :
                 database : base de donnée des applications
@@ -56,15 +57,25 @@ class Application(object):
                     infos['votes'] : Nombre de votes (-2 si les évaluations ne
                                      sont pas supportées, -1 si elles n'ont pas
                                      été téléchargées)
+                relations : dictionnaire contenant les dépendances, icônes et
+                            liens de l'application, déjà récupérés dans la base
+                            de donnée (voir database._get_relations) ; il peut
+                            n'en contenir qu'une partie
+                    relations['depends'] : Liste des dépendances
+                    relations['required_by'] : Liste des applications
+                                               installées qui en dépendent
+                    relations['icons'] : Icônes (taille : chemin)
+                    relations['links'] : Liste des liens
         """
         self.database = database
         self.infos = infos
         self.infos['version'] = version.LooseVersion(self.infos['version'])
         
-        self.depends = database.get_depends(self.id, self.branch, self.repository)
-        self.required_by = database.get_required_by(self.id)
-        self.icons = database.get_icons(self.id, self.branch, self.repository)
-        self.links = database.get_links(self.id, self.branch, self.repository)
+        # Dépendances, icônes et liens déjà chargés
+        if relations == None:
+            self.relations = {}
+        else:
+            self.relations = dict(relations)
         
         self.comments = False
         self.screenshots = False
@@ -235,7 +246,7 @@ class Application(object):
             logger.debug(u"Extraction du paquet.")
             try:
                 infos = self._get_installation_infos(filename)
-                zipextractall(filename,
+                files = zipextractall(filename,
                         os.path.join(self.database.get_config('rootpath'),
                                      infos['install_dir']),
                         lambda c,t: callback(self, 'install',
@@ -265,6 +276,11 @@ class Application(object):
                 self._set_installed_as("explicit")
             else:
                 self._set_installed_as("depend")
+            
+            self.database.set_manifest(self.id,
+                    [(os.path.join(infos['install_dir'], path), size, crc)
+                     for path, size, crc in files])
+            self.database.refresh_installed_application(self.id)
                 
             callback(self, 'install', 100, u"Installation terminée", True)
     
@@ -317,16 +333,22 @@ class Application(object):
             
             infos = self._get_installation_infos()
             
-            # Suppression de l'application
+            # Suppression de l'application (la taille des fichiers installés,
+            # si elle est connue, évite de parcourir le dossier pour afficher
+            # la progression)
             rmtree(os.path.join(self.database.get_config('rootpath'),
                                 infos['application_root']), False,
-                                lambda c,t: callback(self, 'uninstall', 100*c/t,
-                                                u"Suppression de l'application")
+                                lambda c,t: callback(self, 'uninstall', min(100*c/t, 100),
+                                                u"Suppression de l'application"),
+                                foldersize=self.database.get_manifest_size(self.id) or 0
                     )
             
             # Suppression des fichiers de cache
             rmtree('./cache/installed/' + self.id)
             
+            self.database.set_manifest(self.id, [])
+            self.database.refresh_installed_application(self.id)
+            
             callback(self, 'uninstall', 100, u"Désinstallation terminée", True)
     
     def _upgrade(self, callback):
@@ -410,7 +432,7 @@ class Application(object):
                     backupfiles.append(os.path.relpath(os.path.join(root, f), os.path.join('./cache/tmp', self.id)))
             
             try:
-                zipextractall(filename,
+                files = zipextractall(filename,
                         os.path.join(self.database.get_config('rootpath'),
                                      infos['install_dir']),
                         lambda c,t: callback(self, 'upgrade',
@@ -452,9 +474,21 @@ class Application(object):
             
             # Modification du fichier installer.ini
             self._set_installed_as(installed_as)
+            
+            # Les fichiers conservés n'appartiennent pas au paquet
+            self.database.set_manifest(self.id,
+                    [(os.path.join(infos['install_dir'], path), size, crc)
+                     for path, size, crc in files])
+            self.database.refresh_installed_application(self.id)
                 
             callback(self, 'upgrade', 100, u"Mise à jour terminée", True)
     
+    @property
+    def depends(self):
+        if 'depends' not in self.relations:
+            self.relations['depends'] = self.database.get_depends(self.id, self.branch, self.repository)
+        return self.relations['depends']
+    
     def get_comments(self, limit=10):
         """
             Récupère les commentaires
@@ -489,12 +523,10 @@ class Application(object):
         return self.comments
     
     def get_installed_as(self):
-        filename = os.path.join('./cache/installed/', self.id, 'installer.ini')
-        cfg = ConfigParser()
-        cfg.optionxform = str   # Pour conserver la casse
-        cfg.read(filename)
-        
-        return cfg.get("Framakey", "InstalledAs", "explicit")
+        state = self.database.get_installed_state(self.id)
+        if state == None:
+            return "explicit"
+        return state['installed_as']
     
     def get_installed_version(self):
         """Renvoie :
@@ -502,24 +534,14 @@ class Application(object):
                     infos['branch'] : Branche de l'application installée
                     infos['version'] : Version de l'application installée
                 Sinon : None"""
-        if os.path.isfile('./cache/installed/' + self.id + '/appinfo.ini'):
-            cfg = ConfigParser()
-            cfg.read('./cache/installed/' + self.id + '/appinfo.ini')
-            
-            infos = {}
-            
-            try:
-                try:
-                    infos['branch'] = cfg.get('Framakey', 'Branch')
-                except NoOptionError: # Rétrocompatibilité
-                    infos['branch'] = cfg.get('Framakey', 'Repository')
-                infos['version'] = version.LooseVersion(cfg.get('Version', 'PackageVersion'))
-            except (NoSectionError, NoOptionError):
-                return None
-            
-            return infos
-        else:
+        state = self.database.get_installed_state(self.id)
+        if state == None or state['version'] == None:
             return None
+        
+        return {
+                    'branch' : state['branch'],
+                    'version' : version.LooseVersion(state['version'])
+               }
     
     def _get_rating(self):
         """
@@ -574,6 +596,12 @@ class Application(object):
         
         return self.screenshots
     
+    @property
+    def icons(self):
+        if 'icons' not in self.relations:
+            self.relations['icons'] = self.database.get_icons(self.id, self.branch, self.repository)
+        return self.relations['icons']
+    
     def install(self, callback):
         """Installe l'application et ses dépendances"""
         if self.is_installed():
@@ -591,7 +619,7 @@ class Application(object):
                 True si l'application est installée
                 False sinon
         """
-        return os.path.isdir('./cache/installed/' + self.id)
+        return self.database.get_installed_state(self.id) != None
     
     def is_up_to_date(self):
         """
@@ -605,12 +633,18 @@ class Application(object):
             if installed['version'] > self.version:
                 return True
             elif installed['version'] == self.version:
-                return self.branches[installed['branch']] > self.branches[self.branch]
+                return self.branches[installed['branch']] >= self.branches[self.branch]
             else:
                 return False
         else:
             return False
     
+    @property
+    def links(self):
+        if 'links' not in self.relations:
+            self.relations['links'] = self.database.get_links(self.id, self.branch, self.repository)
+        return self.relations['links']
+    
     @property
     def rating(self):
         if self.infos['votes'] == -2:
@@ -620,6 +654,12 @@ class Application(object):
             self._get_rating()
         return self.infos['rating']
     
+    @property
+    def required_by(self):
+        if 'required_by' not in self.relations:
+            self.relations['required_by'] = self.database.get_required_by(self.id)
+        return self.relations['required_by']
+    
     def uninstall(self, with_required_by=False, callback=None):
         """
             Désinstalle l'application
@@ -0,0 +1,80 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+class ApplicationCache(OrderedDict):
+    """
+        Cache (de taille limitée) des objets Application, indexés par
+        (id, branch, repository) : tant que les informations d'une application
+        ne sont pas modifiées, la base de donnée renvoie toujours le même
+        objet. Les applications les moins récemment utilisées sont oubliées
+        lorsque le cache est plein.
+    """
+    def __init__(self, size=512):
+        """
+            Arguments :
+                size : Nombre maximal d'applications
+        """
+        self.size = size
+        
+        OrderedDict.__init__(self)
+    
+    def add(self, application):
+        """
+            Ajoute une application au cache
+            
+            Arguments :
+                application : Objet Application
+        """
+        key = (application.id, application.branch, application.repository)
+        if key in self:
+            del self[key]
+        self[key] = application
+        
+        while len(self) > self.size:
+            self.popitem(last=False)
+    
+    def discard(self, keys):
+        """
+            Oublie des applications
+            
+            Arguments :
+                keys : Liste de tuples (id, branch, repository)
+        """
+        for key in keys:
+            self.pop(key, None)
+    
+    def discard_repository(self, repository):
+        """
+            Oublie toutes les applications d'un dépôt
+            
+            Arguments :
+                repository : Adresse du dépôt ('' pour les applications
+                             installées)
+        """
+        self.discard([key for key in self if key[2] == repository])
+    
+    def discard_relation(self, name):
+        """
+            Oublie une relation (par exemple 'required_by') déjà chargée par
+            les applications, qui sera chargée à nouveau au prochain accès
+            
+            Arguments :
+                name : Nom de la relation
+        """
+        for application in self.itervalues():
+            application.relations.pop(name, None)
+    
+    def get(self, key):
+        """
+            Arguments :
+                key : Tuple (id, branch, repository)
+            
+            Renvoie : L'application si elle est dans le cache, None sinon
+        """
+        application = self.pop(key, None)
+        if application is not None:
+            # L'application devient la plus récemment utilisée
+            self[key] = application
+        return application
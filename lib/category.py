@@ -39,12 +39,16 @@ class Category(object):
         """
         return self.database.get_subcategories(self.id)
     
-    def get_applications(self):
+    def get_applications(self, prefetch=False):
         """
+            Arguments :
+                prefetch : True si les dépendances, icônes et liens des
+                           applications doivent être chargés immédiatement
+            
             Renvoie : Les applications que contient la catégorie (et ses sous
                       catégories)
         """
-        return self.database.get_applications(self.id)
+        return self.database.get_applications(self.id, prefetch)
     
     def remove(self):
         """
@@ -22,7 +22,7 @@ class ConfigParser(RawConfigParser):
             except (NoSectionError, NoOptionError):
                 return args[0]
         else:
-            return RawConfigParser.get(self, section, option)
+            return RawConfigParser.getboolean(self, section, option)
 
     def getint(self, section, option, *args):
         if len(args) > 0:
@@ -31,7 +31,7 @@ class ConfigParser(RawConfigParser):
             except (NoSectionError, NoOptionError):
                 return args[0]
         else:
-            return RawConfigParser.get(self, section, option)
+            return RawConfigParser.getint(self, section, option)
     
     def getlist(self, section, option):
         if not '%d' in option:
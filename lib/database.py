@@ -6,41 +6,116 @@ import logging
 logger = logging.getLogger('synapps')
 
 import os.path
+import re
 import sqlite3
 import urllib2
-import hashlib
 import shutil
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import imap
+from multiprocessing.pool import ThreadPool
 from cfg import ConfigParser, NoSectionError, NoOptionError
-from distutils import version
+from repositoryparser import RepositoryParser
 from locale import strcoll
 
 from category import Category
 from application import Application
+from applicationcache import ApplicationCache
 from jobsqueue import JobsQueue
+from iconstore import IconStore
+import migrations
 
 from exceptions import *
-from functions import get_size, cmp_version, md5file
+from functions import get_size, get_trigrams, md5file, version_key, DecompressedStream
 
-def get_application_cfg_infos(cfg, section, repository):
-    """Récupère les informations sur une application dans le dépôt."""
-    branch, id = tuple(section.split(':', 1))
-    
-    category = cfg.get(section, 'category')
-    name = cfg.get(section, 'name')
-    friendly_name = cfg.get(section, 'friendly_name')
-    short_description = cfg.get(section, 'short_description')
-    long_description = cfg.get(section, 'long_description')
-    size_c = cfg.getint(section, 'size_c')
-    size_u = cfg.getint(section, 'size_u')
-    version = cfg.get(section, 'version')
-    license = cfg.get(section, 'license')
-    author = cfg.get(section, 'author')
-    show = cfg.getboolean(section, 'show')
-    uri = cfg.get(section, 'uri')
-    
-    return (id, branch, repository, category, name, friendly_name, 
-            short_description, long_description, size_c, size_u, 
-            version, license, author, show, uri)
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        # Les dépôts compressés avec xz ne sont pas supportés
+        lzma = None
+
+# Fichiers d'index d'un dépôt, par ordre de préférence, et leur compression
+REPOSITORY_INDEXES = [
+    ('repository.ini.xz', 'xz'),
+    ('repository.ini.gz', 'gzip'),
+    ('repository.ini', None)
+]
+
+# Nombre maximal de paramètres d'une requête "IN (?, ?, ...)" (SQLite en
+# accepte au moins 999)
+MAX_VARIABLES = 500
+
+# Index secondaires : (nom, table, colonnes)
+INDEXES = [
+    ('applications_category', 'applications', 'category'),
+    ('applications_version', 'applications', 'id, version_key'),
+    ('categories_parent', 'categories', 'parent'),
+    ('links_application', 'links', 'application, branch, repository'),
+    ('depends_application', 'depends', 'application, branch, repository'),
+    ('depends_depend', 'depends', 'depend, repository'),
+    ('recommendations_repository', 'recommendations', 'repository'),
+    ('manifest_path', 'manifest', 'path'),
+    ('fuzzy_trigrams_term', 'fuzzy_trigrams', 'term'),
+]
+
+# Requêtes exécutées à la création des objets, qui ne doivent pas parcourir
+# toute la table (voir database.check_indexes)
+INDEXED_QUERIES = [
+    ("SELECT * FROM applications WHERE id = ? "
+     "ORDER BY version_key DESC, repository DESC", ('',)),
+    ("SELECT applications.* FROM category_tree JOIN applications "
+     "ON applications.category = category_tree.descendant "
+     "WHERE category_tree.ancestor = ?", ('',)),
+    ("SELECT id, hash FROM categories WHERE parent = ?", ('',)),
+    ("SELECT depend FROM depends WHERE application = ? "
+     "AND branch = ? AND repository = ?", ('', '', '')),
+    ("SELECT application FROM depends WHERE depend = ? "
+     "AND repository = ''", ('',)),
+    ("SELECT title, uri FROM links WHERE application = ? "
+     "AND branch = ? AND repository = ?", ('', '', '')),
+    ("SELECT size, hash FROM icons WHERE application = ? "
+     "AND branch = ? AND repository = ?", ('', '', '')),
+    ("SELECT application FROM recommendations WHERE repository = ?", ('',)),
+]
+
+# Rang des branches (voir Application.branches), pour les comparer en SQL
+BRANCH_RANK = 'CASE %%s %s ELSE 0 END' % ' '.join("WHEN '%s' THEN %d" % i
+        for i in sorted(Application.branches.items()))
+
+# Similarité minimale (indice de Jaccard des trigrammes) des résultats de
+# database.get_similar_applications
+SIMILARITY_THRESHOLD = 0.3
+
+# Tris possibles des listes d'applications : colonne et expression utilisée
+# pour la comparaison (le nom est trié selon la langue du système)
+SORT_COLUMNS = {
+    'name': ('name', 'name COLLATE unicode'),
+    'rating': ('rating', 'rating'),
+    'size': ('size_u', 'size_u'),
+}
+
+# Colonnes qui départagent les applications égales pour le tri (clé primaire)
+SORT_KEY = ['id', 'branch', 'repository']
+
+# Colonnes indexées par la recherche et leur poids dans le classement
+SEARCH_COLUMNS = [
+    ('name', 10.0),
+    ('friendly_name', 5.0),
+    ('short_description', 2.0),
+    ('long_description', 1.0),
+    ('author', 1.0),
+]
+
+# Modules de recherche plein texte, par ordre de préférence
+SEARCH_MODULES = [
+    ('fts5', "fts5(%s, content='applications', content_rowid='rowid')"),
+    ('fts4', "fts4(%s, content='applications', tokenize=unicode61)"),
+    ('fts4', "fts4(%s, content='applications')"),
+]
 
 def get_category_cfg_infos(cfg, category):
     """Récupère les informations sur une catégorie dans le dépôt."""
@@ -52,34 +127,208 @@ def get_category_cfg_infos(cfg, category):
 def get_category_parent(id):
     return os.path.dirname(id)
 
-def get_repository_cfg(uri):
-    """Renvoie : L'objet ConfigParser associé au dépôt"""
-    # Téléchargement du dépôt
-    try:
-        tmp = urllib2.urlopen(uri + '/repository.ini').read()
-    except (urllib2.URLError, urllib2.HTTPError) as e:
-        logger.warning(u'Impossible de se connecter au dépôt %s' % uri)
-        raise RepositoryConnectionError(uri, e)
+def get_decompressor(compression):
+    """
+        Arguments :
+            compression : 'gzip', 'xz' ou None
         
+        Renvoie : Un objet possédant une méthode decompress, None si les données
+                  ne sont pas compressées
+    """
+    if compression == 'gzip':
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == 'xz':
+        return lzma.LZMADecompressor()
+    else:
+        return None
+
+def get_repository_cfg(uri, stream):
+    """
+        Lit l'index d'un dépôt
+        
+        Arguments :
+            uri : Adresse du dépôt
+            stream : Objet fichier renvoyé par open_repository
+        
+        Renvoie : (cfg, applications)
+            cfg : L'objet RepositoryParser associé au dépôt
+            applications : La liste des applications du dépôt (voir
+                           RepositoryParser) ; si une application est décrite
+                           plusieurs fois, la dernière section l'emporte
+    """
     # Lecture du dépôt
-    cfg = ConfigParser()
+    cfg = RepositoryParser((line.decode('utf-8') for line in stream), uri)
+    applications = OrderedDict()
     try:
-        cfg.read_string(tmp.decode('utf-8'))
+        for application in cfg:
+            id, branch = application[0][:2]
+            if (id, branch) in applications:
+                logger.warning(u"L'application %s:%s est décrite plusieurs fois dans le dépôt %s." % (branch, id, uri))
+            applications[(id, branch)] = application
     except Exception as e:
         logger.warning(u'Le dépôt %s est invalide' % uri)
         raise InvalidRepository(uri, e)
+    finally:
+        stream.close()
+    
+    return cfg, applications.values()
+
+def get_repository_hash(uri):
+    """
+        Renvoie : La somme md5 de l'index du dépôt (fichier
+                  repository.ini.hash), None si elle n'a pas pu être
+                  téléchargée
+    """
+    try:
+        return urllib2.urlopen(uri + '/repository.ini.hash').read()
+    except (urllib2.URLError, urllib2.HTTPError):
+        return None
+
+def open_repository(uri, index_file='', etag='', last_modified=''):
+    """
+        Ouvre le fichier d'index du dépôt : les versions compressées sont
+        essayées en premier, en commençant par index_file. Si etag ou
+        last_modified sont fournis, la requête pour index_file est
+        conditionnelle : le dépôt n'est pas téléchargé s'il n'a pas été modifié.
+        
+        Arguments :
+            uri : Adresse du dépôt
+            index_file : Fichier d'index téléchargé lors de la dernière mise à
+                         jour
+            etag : En-tête ETag de la dernière version téléchargée
+            last_modified : En-tête Last-Modified de la dernière version
+                            téléchargée
+        
+        Renvoie : (stream, index_file, etag, last_modified)
+            stream : Objet fichier décompressant l'index à la volée (None si le
+                     dépôt n'a pas été modifié)
+            index_file, etag, last_modified : Fichier d'index ouvert et ses
+                                              en-têtes
+    """
+    indexes = [i for i in REPOSITORY_INDEXES if i[1] != 'xz' or lzma != None]
+    indexes.sort(key=lambda i: i[0] != index_file)
+    
+    for filename, compression in indexes:
+        request = urllib2.Request(uri + '/' + filename)
+        if filename == index_file:
+            if etag:
+                request.add_header('If-None-Match', etag)
+            if last_modified:
+                request.add_header('If-Modified-Since', last_modified)
+        if compression == None:
+            request.add_header('Accept-Encoding', 'gzip')
+        
+        # Téléchargement du dépôt
+        try:
+            response = urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            if e.code == 304:
+                return None, index_file, etag, last_modified
+            # Cette version de l'index n'existe pas, on essaie la suivante
+            error = e
+        except urllib2.URLError as e:
+            error = e
+            if not isinstance(e.reason, OSError):
+                # Le serveur est injoignable (sinon, c'est un fichier local
+                # qui n'existe pas)
+                break
+        else:
+            headers = response.info()
+            if headers.getheader('Content-Encoding', '') == 'gzip':
+                compression = 'gzip'
+            
+            stream = DecompressedStream(response, get_decompressor(compression))
+            return (stream, filename, headers.getheader('ETag', ''),
+                    headers.getheader('Last-Modified', ''))
     
-    return cfg
+    logger.warning(u'Impossible de se connecter au dépôt %s' % uri)
+    raise RepositoryConnectionError(uri, error)
+
+def fetch_repository(args):
+    """
+        Télécharge et lit un dépôt. Exécutée dans un thread : n'accède pas à la
+        base de donnée.
+        
+        Si le serveur a fourni un en-tête ETag ou Last-Modified lors de la
+        dernière mise à jour, une requête conditionnelle est d'abord envoyée,
+        même si la mise à jour est forcée. Le fichier repository.ini.hash n'est
+        téléchargé que si le serveur renvoie l'index : s'il ne tient pas
+        compte de la requête conditionnelle, un dépôt qui n'a pas été modifié
+        n'est pas lu (sauf si la mise à jour est forcée).
+        
+        Arguments :
+            args : tuple (uri, hash, index_file, etag, last_modified, force)
+                uri : Adresse du dépôt
+                hash : Somme md5 connue du dépôt
+                index_file, etag, last_modified : Fichier d'index téléchargé
+                                                  lors de la dernière mise à
+                                                  jour et ses en-têtes
+                force : True si le dépôt doit être lu même s'il n'a pas été
+                        modifié
+        
+        Renvoie : (uri, new_hash, index, cfg, applications, error)
+            new_hash : Nouvelle somme md5 du dépôt
+            index : tuple (index_file, etag, last_modified) de la nouvelle
+                    version
+            cfg, applications : voir get_repository_cfg (None si le dépôt n'a
+                                pas été modifié ou en cas d'erreur)
+            error : Exception levée lors de la lecture du dépôt (None sinon)
+    """
+    uri, hash, index_file, etag, last_modified, force = args
+    index = (index_file, etag, last_modified)
+    
+    conditional = bool(etag or last_modified)
+    if conditional:
+        # La somme md5 n'est téléchargée que si le dépôt est renvoyé
+        new_hash = None
+    else:
+        new_hash = get_repository_hash(uri)
+        if hash == new_hash and not force:
+            return uri, new_hash, index, None, None, None
+    
+    try:
+        stream, index_file, etag, last_modified = open_repository(uri, *index)
+        if stream == None:
+            return uri, new_hash, index, None, None, None
+        
+        if conditional:
+            # Le dépôt a été modifié, ou le serveur n'a pas tenu compte de la
+            # requête conditionnelle
+            new_hash = get_repository_hash(uri)
+            if new_hash != None and hash == new_hash and not force:
+                stream.close()
+                return uri, new_hash, index, None, None, None
+        
+        cfg, applications = get_repository_cfg(uri, stream)
+    except (RepositoryConnectionError, InvalidRepository) as e:
+        return uri, new_hash, index, None, None, e
+    
+    return uri, new_hash, (index_file, etag, last_modified), cfg, applications, None
+
+def parse_config_value(value):
+    """
+        Renvoie : La valeur d'une propriété, convertie en entier ou en booléen
+                  si possible
+    """
+    if value == None:
+        return None
+    elif value.isdigit():
+        return int(value)
+    elif value.lower() == 'true':
+        return True
+    elif value.lower() == 'false':
+        return False
+    else:
+        return value
 
 class database():
     def __init__(self):
         """Connection à la base de donnée locale des applications"""
-        if not os.path.isfile("cache/apps.sqlite"):
+        created = not os.path.isfile("cache/apps.sqlite")
+        if created:
             logger.info(u"Le fichier cache/apps.sqlite n'existe pas.")
             logger.info(u"Création de la base de donnée.")
-            self.connection = sqlite3.connect("cache/apps.sqlite")
-            self.connection.row_factory = sqlite3.Row
-            self.curseur = self.connection.cursor()
+            self._connect()
             
             #  Création des tables
             logger.debug(u"Création des tables.")
@@ -93,6 +342,9 @@ class database():
             self.curseur.execute("CREATE TABLE repositories ("
                 "uri TEXT PRIMARY KEY UNIQUE,"
                 "hash TEXT DEFAULT '',"
+                "index_file TEXT DEFAULT '',"
+                "etag TEXT DEFAULT '',"
+                "last_modified TEXT DEFAULT '',"
                 "show_recommendations BOOL DEFAULT 1)")
             
             # Recommendations
@@ -103,8 +355,20 @@ class database():
             # Catégories
             self.curseur.execute("CREATE TABLE categories ("
                 "id TEXT PRIMARY KEY UNIQUE,"
+                "parent TEXT,"
                 "hash TEXT)")
             
+            # Ancêtres de chaque catégorie (elle même comprise)
+            self.curseur.execute("CREATE TABLE category_tree ("
+                "ancestor TEXT,"
+                "descendant TEXT,"
+                "PRIMARY KEY (ancestor, descendant))")
+            
+            # Nombre d'applications par catégorie (sous catégories comprises)
+            self.curseur.execute("CREATE TABLE category_counts ("
+                "category TEXT PRIMARY KEY UNIQUE,"
+                "count INT)")
+            
             # Applications
             self.curseur.execute("CREATE TABLE applications ("
                 "id TEXT,"
@@ -118,6 +382,7 @@ class database():
                 "size_c INT,"
                 "size_u INT,"
                 "version TEXT,"
+                "version_key TEXT,"
                 "rating INT DEFAULT 0,"
                 "votes INT DEFAULT -1,"
                 "license TEXT,"
@@ -150,6 +415,45 @@ class database():
                 "hash TEXT,"
                 "PRIMARY KEY (application, branch, repository, size))")
             
+            # Trigrammes des identifiants et noms des applications (recherche
+            # approximative)
+            self.curseur.execute("CREATE TABLE fuzzy_terms ("
+                "id INTEGER PRIMARY KEY,"
+                "application TEXT,"
+                "trigrams INT)")
+            self.curseur.execute("CREATE TABLE fuzzy_trigrams ("
+                "trigram TEXT,"
+                "term INT,"
+                "PRIMARY KEY (trigram, term))")
+            
+            # Applications installées (dossier de l'application, état des
+            # fichiers de ./cache/installed/id lors de leur lecture et option
+            # InstalledAs)
+            self.curseur.execute("CREATE TABLE installed ("
+                "id TEXT PRIMARY KEY UNIQUE,"
+                "root TEXT,"
+                "stamp TEXT,"
+                "installed_as TEXT)")
+            
+            # Fichiers installés par chaque application (chemins relatifs au
+            # dossier rootpath)
+            self.curseur.execute("CREATE TABLE manifest ("
+                "application TEXT,"
+                "path TEXT,"
+                "size INT,"
+                "crc INT,"
+                "PRIMARY KEY (application, path))")
+            
+            # Fichiers des icônes
+            self.curseur.execute("CREATE TABLE icon_files ("
+                "hash TEXT PRIMARY KEY UNIQUE,"
+                "uri TEXT,"
+                "size INT,"
+                "last_access INT)")
+            
+            self._create_indexes()
+            self._create_search_index()
+            
             # Ajout des sources par défaut
             logger.debug(u"Ajout des dépôts Framakey.")
             self.add_repository('http://localhost/fk2')
@@ -162,59 +466,80 @@ class database():
             self.set_config('show_stable', True)
             self.set_config('show_unstable', True)
             self.set_config('show_testing', True)
+            self.set_config('update_workers', 4)
+            self.set_config('icons_max_size', 0)
             
             # Exécution
             self.connection.commit()
+            migrations.set_version(self, migrations.SCHEMA_VERSION)
         else:
             logger.debug(u"Le fichier cache/apps.sqlite existe.")
-            self.connection = sqlite3.connect("cache/apps.sqlite")
-            self.connection.row_factory = sqlite3.Row
-            self.curseur = self.connection.cursor()
+            self._connect()
+            
+            migrations.upgrade(self)
             
             # On force les évaluations à être mises à jour
             self._execute("UPDATE applications SET votes = -1")
         
         # Tri
         self.connection.create_collation("unicode", strcoll)
-        self.connection.create_collation("desc_versions", cmp_version)
+        
+        # Recherche
+        self.search_module = self._get_search_module()
         
         # Queue des opérations
-        self.jobs_queue = JobsQueue()
+        self.jobs_queue = JobsQueue(self)
+        
+        # Applications déjà créées
+        self.applications_cache = ApplicationCache()
+        
+        # État des applications installées (chargé au premier accès)
+        self.installed_state = None
         
-    def _add_application(self, id, branch, repository, category, name,
-                        friendly_name, short_description,
-                        long_description, size_c, size_u, version,
-                        license, author, show, uri, rating=0, votes=-1):
+        # Cache des icônes
+        self.icon_store = IconStore(self, './cache/icons',
+                                    self.get_config('update_workers', 4))
+        if created:
+            # Icônes téléchargées avant la création de la base
+            self.icon_store.import_directory()
+            self.connection.commit()
+        
+    def _add_applications(self, applications):
         """
-            Ajoute une application
+            Ajoute des applications (la clé de tri de la version est
+            calculée à l'insertion)
             
             Arguments :
-                id : Identifiant de l'application
-                branch : Brance ('Stable', 'Unstable' ou 'Testing')
-                repository : Adresse du dépôt
-                category : Catégorie (categorie/sous categorie/...)
-                name : Nom de l'application
-                friendly_name : Description courte (quelques mots)
-                short_description : Description courte (une phrase)
-                long_description : Description longue
-                size_c : Taille compressé
-                size_u : Taille décompressé
-                version : Version (chaine de caractères)
-                license : License
-                author : Mainteneur du paquet
-                show : True si le paquet doit être affiché dans l'interface
-                       False sinon
-                uri : adresse du paque
-        """
-        self.curseur.execute("INSERT INTO applications (id, branch, repository, "
+                applications : liste de tuples (id, branch, repository,
+                               category, name, friendly_name,
+                               short_description, long_description, size_c,
+                               size_u, version, license, author, show, uri,
+                               rating, votes)
+                    id : Identifiant de l'application
+                    branch : Brance ('Stable', 'Unstable' ou 'Testing')
+                    repository : Adresse du dépôt
+                    category : Catégorie (categorie/sous categorie/...)
+                    name : Nom de l'application
+                    friendly_name : Description courte (quelques mots)
+                    short_description : Description courte (une phrase)
+                    long_description : Description longue
+                    size_c : Taille compressé
+                    size_u : Taille décompressé
+                    version : Version (chaine de caractères)
+                    license : License
+                    author : Mainteneur du paquet
+                    show : True si le paquet doit être affiché dans l'interface
+                           False sinon
+                    uri : adresse du paque
+                    rating : Note de l'application
+                    votes : Nombre de votes
+        """
+        self.curseur.executemany("INSERT INTO applications (id, branch, repository, "
                 "category, name, friendly_name, short_description, "
                 "long_description, size_c, size_u, version, "
-                "license, author, show, uri, rating, votes) VALUES "
-                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-                (id, branch, repository,
-                category, name, friendly_name, short_description,
-                long_description, size_c, size_u, version,
-                license, author, show, uri, rating, votes))
+                "license, author, show, uri, rating, votes, version_key) VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (i + (version_key(i[10]),) for i in applications))
     
     def _add_category(self, id, icon_uri=None, newhash=None, cfg=None):
         """
@@ -224,8 +549,7 @@ class database():
                 id : Identifiant de la catégorie
                 icon_uri : Adresse de l'icône
                 newhash : Somme md5 de la nouvelle icône
-                cfg : Objet ConfigParser associé au fichier de configuration du
-                      dépôt
+                cfg : Objet RepositoryParser associé au dépôt
         """
         try:
             hash = self._get_category_hash(id)
@@ -236,89 +560,210 @@ class database():
             # La catégorie est celle d'une application installée, pas d'informations
              if hash == None:
                 # La catégorie n'existe pas
-                self.curseur.execute("INSERT INTO categories (id, hash) "
-                        "VALUES (?, ?)", (id, ''))
+                self.curseur.execute("INSERT INTO categories (id, parent, hash) "
+                        "VALUES (?, ?, ?)", (id, get_category_parent(id) if id else None, ''))
                 # On ajoute les parents de la catégorie
                 self._add_category(get_category_parent(id))
         elif hash != newhash:
             # Le hash a changé
-            if not os.path.isfile('./cache/icons/' + newhash + '.png'):
-                try:
-                    with open('./cache/icons/' + newhash + '.png', 'wb') as f:
-                        f.write(urllib2.urlopen(icon_uri).read())
-                except:
-                    logger.warning(u"Impossible de télécharger l'icône %s." % icon_uri)
+            if newhash:
+                self.icon_store.download(icon_uri, newhash)
             
             if hash == None:
                 # La catégorie n'existe pas
-                self.curseur.execute("INSERT INTO categories (id, hash) "
-                        "VALUES (?, ?)", (id, newhash))
+                self.curseur.execute("INSERT INTO categories (id, parent, hash) "
+                        "VALUES (?, ?, ?)", (id, get_category_parent(id) if id else None, newhash))
                 # On ajoute les parents de la catégorie
                 self._add_category(*get_category_cfg_infos(cfg, get_category_parent(id)))
             else:
                 self.curseur.execute("UPDATE categories SET hash = ? "
                         "WHERE id = ?", (newhash, id))
     
-    def _add_depend(self, id, branch, repository, depend):
+    def _add_depends(self, depends):
         """
-            Ajoute une dépendance
+            Ajoute des dépendances
         
             Arguments :
-                id : Identifiant de l'application
-                branch : Branche de l'application
-                repository : Dépôt de l'application
-                depend : Identifiant de la dépendance
+                depends : liste de tuples (id, branch, repository, depend)
+                    id : Identifiant de l'application
+                    branch : Branche de l'application
+                    repository : Dépôt de l'application
+                    depend : Identifiant de la dépendance
         """
-        self.curseur.execute("INSERT INTO depends (application, branch, repository, depend) "
-                "VALUES (?, ?, ?, ?)", (id, branch, repository, depend))
+        self.curseur.executemany("INSERT INTO depends (application, branch, repository, depend) "
+                "VALUES (?, ?, ?, ?)", depends)
     
-    def _add_icon(self, id, branch, repository, size, uri, hash):
+    def _add_icons(self, icons):
         """
-            Ajoute une icône d'une application
+            Ajoute des icônes d'applications et met en file d'attente le
+            téléchargement de celles qui ne sont pas dans le cache
             
             Arguments :
-                id : Identifiant de l'application
-                branch : Branche de l'application
-                repository : Dépôt de l'application
-                size : Taille de l'icône
-                uri : Adresse de l'icône
-                hash : Somme md5 de l'icône
+                icons : liste de tuples (id, branch, repository, size, uri, hash)
+                    id : Identifiant de l'application
+                    branch : Branche de l'application
+                    repository : Dépôt de l'application
+                    size : Taille de l'icône
+                    uri : Adresse de l'icône
+                    hash : Somme md5 de l'icône
         """
-        self.curseur.execute("INSERT INTO icons (application, branch, repository, size, hash) "
-                "VALUES (?,?,?,?,?)", (id, branch, repository, size, hash))
+        self.curseur.executemany("INSERT INTO icons (application, branch, repository, size, hash) "
+                "VALUES (?,?,?,?,?)", [i[:4] + i[5:] for i in icons])
         
-        if not os.path.isfile('./cache/icons/' + hash + '.png'):
-            try:
-                with open('./cache/icons/' + hash + '.png', 'wb') as f:
-                    f.write(urllib2.urlopen(uri).read())
-            except NoOptionError:
-                logger.warning(u"Impossible de télécharger l'icône %s." % uri)
+        for id, branch, repository, size, uri, hash in icons:
+            self.icon_store.download(uri, hash)
     
-    def _add_link(self, id, branch, repository, title, uri):
+    def _add_links(self, links):
         """
-            Ajoute un lien
+            Ajoute des liens
             
             Arguments :
-                id : Identifiant de l'application
-                branch : Branche de l'application
-                repository : Dépôt de l'application
-                title : Titre du lien
-                uri : Adresse du lien
+                links : liste de tuples (id, branch, repository, title, uri)
+                    id : Identifiant de l'application
+                    branch : Branche de l'application
+                    repository : Dépôt de l'application
+                    title : Titre du lien
+                    uri : Adresse du lien
         """
-        self.curseur.execute("INSERT INTO links (application, branch, repository, title, uri) "
-                "VALUES (?, ?, ?, ?, ?)", (id, branch, repository, title, uri))
+        self.curseur.executemany("INSERT INTO links (application, branch, repository, title, uri) "
+                "VALUES (?, ?, ?, ?, ?)", links)
     
-    def _add_recommendation(self, repository, recommendation):
+    def _add_recommendations(self, repository, recommendations):
         """
-            Ajoute une recommendation
+            Ajoute des recommendations
             
             Arguments :
                 repository : Adresse du Dépôt
-                recommendation : Identificant de l'application recommendée
+                recommendations : Identifiants des applications recommendées
+        """
+        self.curseur.executemany("INSERT INTO recommendations (repository, application) "
+                "VALUES (?, ?)", [(repository, i) for i in recommendations])
+    
+    @contextmanager
+    def _bulk_load(self):
+        """
+            Exécute les écritures du bloc dans une seule transaction, validée à
+            la fin du bloc (annulée en cas d'erreur). La synchronisation reste
+            celle choisie par _connect : la base contient aussi des données
+            qui ne peuvent pas être téléchargées à nouveau (configuration,
+            applications installées), et le mode WAL rend déjà les
+            validations peu coûteuses.
+        """
+        # Les commandes PRAGMA valident la transaction en cours
+        self.connection.commit()
+        self.curseur.execute("PRAGMA temp_store = MEMORY")
+        try:
+            yield
+        except:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+        finally:
+            self.curseur.execute("PRAGMA temp_store = DEFAULT")
+    
+    def _check_config_version(self):
         """
-        self.curseur.execute("INSERT INTO recommendations (repository, application) "
-                "VALUES (?, ?)", (repository, recommendation))
+            Oublie la configuration chargée en mémoire si la base a été
+            modifiée par une autre connexion. Appelée au début des opérations
+            (mise à jour, installation...) et non à chaque lecture : les
+            commandes PRAGMA valident la transaction en cours.
+        """
+        # data_version change lorsqu'une autre connexion modifie la base
+        data_version = self._query("PRAGMA data_version")[0][0]
+        if data_version != self.config_version:
+            self.config = None
+            self.config_version = data_version
+    
+    def _connect(self):
+        """
+            Ouvre la base de donnée locale. Le journal en mode WAL et la
+            synchronisation réduite limitent le nombre d'écritures (et
+            d'attentes) sur les clés USB.
+        """
+        self.connection = sqlite3.connect("cache/apps.sqlite")
+        self.connection.row_factory = sqlite3.Row
+        self.curseur = self.connection.cursor()
+        
+        # Configuration, chargée au premier accès
+        self.config = None
+        self.config_version = None
         
+        journal_mode = self._query("PRAGMA journal_mode = WAL")[0][0]
+        if journal_mode.lower() != 'wal':
+            logger.debug(u"Le journal de la base de donnée ne peut pas être en mode WAL (%s)." % journal_mode)
+        # En mode WAL, NORMAL ne met pas en danger l'intégrité de la base
+        self.curseur.execute("PRAGMA synchronous = NORMAL")
+        # Taille du cache en kio
+        self.curseur.execute("PRAGMA cache_size = -8192")
+    
+    def _create_indexes(self, names=None):
+        """
+            Crée les index secondaires qui n'existent pas encore
+            
+            Arguments :
+                names : Noms des index à créer (tous par défaut)
+        """
+        for name, table, columns in INDEXES:
+            if names != None and name not in names:
+                continue
+            self.curseur.execute("CREATE INDEX IF NOT EXISTS %s ON %s (%s)"
+                    % (name, table, columns))
+    
+    def _create_search_index(self):
+        """
+            Crée l'index de recherche plein texte (FTS5, ou FTS4 si SQLite
+            n'a pas été compilé avec FTS5) et les déclencheurs qui le
+            synchronisent avec la table applications
+            
+            Renvoie : Le module utilisé, None si SQLite ne permet pas la
+                      recherche plein texte
+        """
+        columns = [name for name, weight in SEARCH_COLUMNS]
+        for module, definition in SEARCH_MODULES:
+            try:
+                self.curseur.execute("CREATE VIRTUAL TABLE applications_fts USING "
+                        + definition % ', '.join(columns))
+                break
+            except sqlite3.OperationalError:
+                pass
+        else:
+            logger.warning(u"La recherche plein texte n'est pas supportée par SQLite.")
+            return None
+        
+        new = ', '.join('new.' + i for i in columns)
+        old = ', '.join('old.' + i for i in columns)
+        if module == 'fts5':
+            insert = ("INSERT INTO applications_fts (rowid, %s) "
+                      "VALUES (new.rowid, %s);" % (', '.join(columns), new))
+            delete = ("INSERT INTO applications_fts (applications_fts, rowid, %s) "
+                      "VALUES ('delete', old.rowid, %s);" % (', '.join(columns), old))
+            # FTS5 supprime les termes à partir des anciennes valeurs
+            before_delete, after_delete = '', delete
+        else:
+            insert = ("INSERT INTO applications_fts (docid, %s) "
+                      "VALUES (new.rowid, %s);" % (', '.join(columns), new))
+            delete = "DELETE FROM applications_fts WHERE docid = old.rowid;"
+            # FTS4 lit les anciennes valeurs dans la table applications
+            before_delete, after_delete = delete, ''
+        
+        # Seules les colonnes indexées déclenchent la mise à jour de l'index
+        # (et pas les évaluations par exemple)
+        update = "UPDATE OF %s ON applications" % ', '.join(columns)
+        triggers = [
+            ('applications_fts_insert', "AFTER INSERT ON applications", insert),
+            ('applications_fts_before_delete', "BEFORE DELETE ON applications", before_delete),
+            ('applications_fts_after_delete', "AFTER DELETE ON applications", after_delete),
+            ('applications_fts_before_update', "BEFORE " + update, before_delete),
+            ('applications_fts_after_update', "AFTER " + update, after_delete + insert),
+        ]
+        for name, event, action in triggers:
+            if action:
+                self.curseur.execute("CREATE TRIGGER %s %s BEGIN %s END"
+                        % (name, event, action))
+        
+        return module
+    
     def _execute(self, query, data=()):
         """
             Éxecute une commande SQL nécessitant un "commit" (insertion,
@@ -345,12 +790,12 @@ class database():
         """
         if branch == None:
             if repository == None:
-                apps = self._query("SELECT * FROM applications WHERE id = ?"
-                                  "ORDER BY version COLLATE desc_versions, repository DESC", (id,))
+                apps = self._query("SELECT * FROM applications WHERE id = ? "
+                                  "ORDER BY version_key DESC, repository DESC", (id,))
             else:
                 apps = self._query("SELECT * FROM applications WHERE id = ? "
                                   "AND repository = ? "
-                                  "ORDER BY version COLLATE desc_versions", (id, repository))
+                                  "ORDER BY version_key DESC", (id, repository))
             try:
                 version = apps[0]['version']
             except IndexError:
@@ -372,23 +817,58 @@ class database():
         else:
             if repository == None:
                 apps = self._query("SELECT * FROM applications WHERE id = ? "
-                                  "AND branch ? "
-                                  "ORDER BY version COLLATE desc_versions, repository DESC", (id, branch))
+                                  "AND branch = ? "
+                                  "ORDER BY version_key DESC, repository DESC", (id, branch))
             else:
                 apps = self._query("SELECT * FROM applications WHERE id = ? "
                                   "AND branch = ? "
                                   "AND repository = ? "
-                                  "ORDER BY version COLLATE desc_versions", (id, branch, repository))
+                                  "ORDER BY version_key DESC", (id, branch, repository))
             if (self.get_config("show_" + branch.lower(), False) or not shown) and len(apps) > 0:
                 return dict(apps[0])
             else:
                 raise NoSuchApplication(id, branch, repository)
     
+    def _get_applications(self, rows, prefetch=False):
+        """
+            Arguments :
+                rows : Lignes de la table applications
+                prefetch : True si les dépendances, icônes et liens des
+                           applications doivent être chargés immédiatement
+            
+            Renvoie : Les objets Application correspondants (ceux qui sont
+                      dans le cache sont réutilisés)
+        """
+        # Seules les applications qui ne sont pas dans le cache sont créées
+        keys = [(i['id'], i['branch'], i['repository']) for i in rows]
+        cached = dict((key, self.applications_cache.get(key)) for key in keys)
+        missing = [dict(i) for key, i in zip(keys, rows) if cached[key] is None]
+        if prefetch:
+            relations = self._get_relations(missing)
+        else:
+            relations = {}
+        for i in missing:
+            key = (i['id'], i['branch'], i['repository'])
+            cached[key] = Application(self, i, relations.get(key))
+            self.applications_cache.add(cached[key])
+        
+        return [cached[key] for key in keys]
+    
+    def _get_categories(self, rows):
+        """
+            Arguments :
+                rows : Liste de tuples (id, hash) de la table categories
+            
+            Renvoie : Les objets Category correspondants
+        """
+        return [Category(self, {'id': id, 'icon': self.icon_store.get(hash)})
+                for id, hash in rows]
+    
     def _get_category_infos(self, id):
         infos = {}
         infos['id'] = id
         hash = self._get_category_hash(id)
-        infos['icon'] = './cache/icons/' + hash + '.png'
+        infos['icon'] = self.icon_store.get(hash)
         return infos
     
     def _get_category_hash(self, id):
@@ -404,20 +884,40 @@ class database():
         except IndexError:
             raise NoSuchCategory(id)
 
-    def _get_installed_application_cfg_infos(self, id):
+    def _get_installed_application_cfg_infos(self, id, rootpath, workers):
+        """
+            Arguments :
+                id : Identifiant de l'application installée
+                rootpath : Dossier racine des applications (propriété
+                           rootpath)
+                workers : Nombre de threads utilisés pour calculer la taille
+                          de l'application (propriété update_workers)
+            
+            Renvoie : Un tuple (infos, links, depends, root, installed_as) lu
+                      dans les fichiers de ./cache/installed/id, (None, None,
+                      None, None, None) si l'application n'est plus installée
+                      ou si ses informations sont incomplètes
+                infos : tuple (voir _add_applications)
+                links : liste de tuples (title, uri)
+                depends : liste des identifiants des dépendances
+                root : dossier de l'application
+                installed_as : 'explicit' ou 'depend'
+        """
         repository = u''
         
         try:
             cfg = ConfigParser()
             cfg.read(['./cache/installed/' + id + '/appinfo.ini', './cache/installed/' + id + '/installer.ini'])
             
-            root = os.path.join(self.get_config('rootpath'), cfg.get('Framakey', 'ApplicationRoot', 'Apps/%s' % id))
+            root = os.path.join(rootpath, cfg.get('Framakey', 'ApplicationRoot', 'Apps/%s' % id))
             if os.path.exists(root):
-                size_u = get_size(root)
+                size_u = self.get_manifest_size(id)
+                if size_u == None:
+                    size_u = get_size(root, workers)
             else:
                 logger.debug(u"L'application %s n'est plus installée, suppression des fichiers de cache." % id)
                 shutil.rmtree('./cache/installed/' + id)
-                return None, None, None
+                return None, None, None, None, None
             
             try:
                 branch = cfg.get('Framakey', 'Branch')
@@ -437,9 +937,10 @@ class database():
             uri = ''
         except (NoSectionError, NoOptionError):
             logger.debug(u"Les informations de l'application %s sont incomplètes." % id)
-            return None, None, None
+            return None, None, None, None, None
         
         depends = cfg.getlist('Framakey', 'Depend')
+        installed_as = cfg.get('Framakey', 'InstalledAs', 'explicit')
         
         links = []
         try:
@@ -459,23 +960,134 @@ class database():
         
         return (id, branch, repository, category, name, friendly_name, 
                 short_description, long_description, size_c, size_u, 
-                version, license, author, show, uri, 0, -2), links, depends
+                version, license, author, show, uri, 0, -2), links, depends, root, installed_as
     
-    def _icon_used(self, hash):
+    def _get_installed_stamp(self, id):
         """
+            Renvoie : Une chaîne décrivant l'état (date de modification et
+                      taille) des fichiers de ./cache/installed/id
+        """
+        directory = os.path.join('./cache/installed', id)
+        stamp = []
+        for filename in sorted(os.listdir(directory)):
+            infos = os.stat(os.path.join(directory, filename))
+            stamp.append('%s:%d:%d' % (filename, infos.st_mtime, infos.st_size))
+        return '|'.join(stamp)
+    
+    def _get_relations(self, applications):
+        """
+            Récupère en quelques requêtes les dépendances, icônes et liens
+            d'une liste d'applications
+            
             Arguments :
-                hash : Somme md5 d'une icône
+                applications : Liste des informations des applications
+                               (dictionnaires, voir _get_application_infos)
             
-            Renvoie : True si l'icône est utilisée, False sinon.
+            Renvoie : Un dictionnaire (id, branch, repository) : relations
+                      (voir Application.__init__)
         """
-        if self._query('SELECT COUNT(hash) FROM categories WHERE hash = ?', (hash,))[0][0] > 0:
-            # L'icône est utilisée pour une catégorie
-            return True
-        elif self._query('SELECT COUNT(hash) FROM icons WHERE hash = ?', (hash,))[0][0] > 0:
-            # L'icône est utilisée pour une application
-            return True
-        else:
-            return False
+        relations = {}
+        for i in applications:
+            relations[(i['id'], i['branch'], i['repository'])] = {
+                'depends': [], 'required_by': [], 'icons': {}, 'links': []}
+        
+        ids = list(set(i['id'] for i in applications))
+        required_by = {}
+        for start in xrange(0, len(ids), MAX_VARIABLES):
+            chunk = ids[start:start + MAX_VARIABLES]
+            marks = ', '.join('?' * len(chunk))
+            
+            for application, branch, repository, depend in self._query("SELECT "
+                    "application, branch, repository, depend FROM depends "
+                    "WHERE application IN (%s)" % marks, chunk):
+                if (application, branch, repository) in relations:
+                    relations[(application, branch, repository)]['depends'].append(depend)
+            
+            for depend, application in self._query("SELECT depend, application "
+                    "FROM depends WHERE depend IN (%s) AND repository = ''" % marks, chunk):
+                required_by.setdefault(depend, []).append(application)
+            
+            for application, branch, repository, size, hash in self._query("SELECT "
+                    "application, branch, repository, size, hash FROM icons "
+                    "WHERE application IN (%s)" % marks, chunk):
+                if (application, branch, repository) in relations:
+                    relations[(application, branch, repository)]['icons'][size] = self.icon_store.get(hash)
+            
+            for link in self._query("SELECT application, branch, repository, "
+                    "title, uri FROM links WHERE application IN (%s)" % marks, chunk):
+                key = (link['application'], link['branch'], link['repository'])
+                if key in relations:
+                    relations[key]['links'].append({'title': link['title'],
+                                                    'uri': link['uri']})
+        
+        for (id, branch, repository), i in relations.items():
+            i['required_by'] = list(required_by.get(id, []))
+        
+        return relations
+    
+    def _get_repository_contents(self, uri):
+        """
+            Arguments :
+                uri : Adresse du dépôt
+            
+            Renvoie : Le contenu du dépôt enregistré dans la base de donnée,
+                      sous la forme d'un dictionnaire
+                      (id, branch) : (infos, links, depends, icons)
+                infos : tuple (category, name, ..., uri) dans l'ordre de
+                        get_application_cfg_infos
+                links : liste de tuples (title, uri)
+                depends : liste des identifiants des dépendances
+                icons : liste de tuples (size, hash)
+        """
+        contents = {}
+        for row in self._query("SELECT id, branch, category, name, "
+                "friendly_name, short_description, long_description, "
+                "size_c, size_u, version, license, author, show, uri "
+                "FROM applications WHERE repository = ?", (uri,)):
+            contents[(row[0], row[1])] = (tuple(row)[2:], [], [], [])
+        
+        for application, branch, title, link in self._query("SELECT application, "
+                "branch, title, uri FROM links WHERE repository = ? "
+                "ORDER BY rowid", (uri,)):
+            if (application, branch) in contents:
+                contents[(application, branch)][1].append((title, link))
+        
+        for application, branch, depend in self._query("SELECT application, "
+                "branch, depend FROM depends WHERE repository = ? "
+                "ORDER BY rowid", (uri,)):
+            if (application, branch) in contents:
+                contents[(application, branch)][2].append(depend)
+        
+        for application, branch, size, hash in self._query("SELECT application, "
+                "branch, size, hash FROM icons WHERE repository = ? "
+                "ORDER BY size", (uri,)):
+            if (application, branch) in contents:
+                contents[(application, branch)][3].append((size, hash))
+        
+        return contents
+    
+    def _get_search_module(self):
+        """
+            Renvoie : Le module de l'index de recherche ('fts5' ou 'fts4'),
+                      None s'il n'existe pas
+        """
+        try:
+            sql = self._query("SELECT sql FROM sqlite_master "
+                    "WHERE name = 'applications_fts'")[0][0]
+        except IndexError:
+            return None
+        
+        for module, definition in SEARCH_MODULES:
+            if module in sql.lower():
+                return module
+        return None
+    
+    def _load_config(self):
+        """
+            Charge la configuration en mémoire (voir _check_config_version)
+        """
+        self.config = dict((name, parse_config_value(value)) for name, value
+                           in self._query("SELECT name, value FROM config"))
     
     def _query(self, query, data=()):
         """Éxecute une commande SQL de type "SELECT"
@@ -483,31 +1095,88 @@ class database():
         self.curseur.execute(query, data)
         return self.curseur.fetchall()
     
-    def _remove_all_from_repository(self, uri):
+    def _remove_applications(self, applications):
         """
-            Supprime le contenu d'un dépôt
+            Supprime des applications, leurs liens, dépendances et icônes
             
             Arguments :
-                uri : Adresse du dépôt
+                applications : liste de tuples (id, branch, repository)
         """
-        self._execute("DELETE FROM applications WHERE repository = ?", (uri,))
-        self._execute("DELETE FROM recommendations WHERE repository = ?", (uri,))
+        self.curseur.executemany("DELETE FROM applications WHERE id = ? "
+                "AND branch = ? AND repository = ?", applications)
         
-        self._execute("DELETE FROM depends WHERE repository = ?", (uri,))
-        self._execute("DELETE FROM links WHERE repository = ?", (uri,))
-        self._execute("DELETE FROM icons WHERE repository = ?", (uri,))
+        for table in ['links', 'depends', 'icons']:
+            self._remove_relations(table, applications)
     
     def _remove_empty_categories(self):
         """Supprime les catégories vides"""
-        for category in self.get_categories():
-            if category.count_applications() == 0:
-                category.remove()
+        self.curseur.execute("DELETE FROM categories WHERE id NOT IN "
+                "(SELECT category FROM category_counts)")
+        self.curseur.execute("DELETE FROM category_tree WHERE descendant NOT IN "
+                "(SELECT category FROM category_counts)")
     
-    def _remove_old_icons(self):
-        """Supprime les icônes inutilisées"""
-        for filename in os.listdir("./cache/icons"):
-            if not self._icon_used(filename[:-4]):
-                os.remove("./cache/icons/" + filename)
+    def _remove_installed_application(self, id):
+        """
+            Supprime une application installée de la base de donnée
+            
+            Arguments :
+                id : Identifiant de l'application
+        """
+        for table, column in [('applications', 'id'), ('links', 'application'),
+                              ('depends', 'application'), ('icons', 'application')]:
+            self.curseur.execute("DELETE FROM %s WHERE %s = ? AND repository = ''"
+                    % (table, column), (id,))
+        self.curseur.execute("DELETE FROM installed WHERE id = ?", (id,))
+        self.installed_state = None
+    
+    def _remove_relations(self, table, applications):
+        """
+            Supprime les liens, dépendances ou icônes d'applications
+            
+            Arguments :
+                table : 'links', 'depends' ou 'icons'
+                applications : liste de tuples (id, branch, repository)
+        """
+        self.curseur.executemany("DELETE FROM %s WHERE application = ? "
+                "AND branch = ? AND repository = ?" % table, applications)
+    
+    def _scan_installed_application(self, id, rootpath, workers):
+        """
+            Lit les informations d'une application installée et les enregistre
+            dans la base de donnée (ou l'en supprime si elle n'est plus
+            installée)
+            
+            Arguments :
+                id : Identifiant de l'application
+                rootpath, workers : voir _get_installed_application_cfg_infos
+        """
+        self._remove_installed_application(id)
+        if not os.path.isdir(os.path.join('./cache/installed', id)):
+            return
+        
+        infos, links, depends, root, installed_as = self._get_installed_application_cfg_infos(id, rootpath, workers)
+        if not infos:
+            if os.path.isdir(os.path.join('./cache/installed', id)):
+                # Informations incomplètes : l'application est installée, mais
+                # sera lue à nouveau à la prochaine mise à jour
+                self.curseur.execute("INSERT INTO installed (id) VALUES (?)", (id,))
+            return
+        
+        branch = infos[1]
+        self._add_applications([infos])
+        self._add_category(infos[3])
+        self._add_links([(id, branch, u'', title, uri) for title, uri in links])
+        self._add_depends([(id, branch, u'', depend) for depend in depends])
+        
+        icons = []
+        for size in [32,48,64,128]:
+            filename = './cache/installed/%s/appicon_%d.png' % (id, size)
+            if os.path.isfile(filename):
+                icons.append((id, branch, u'', size, filename, md5file(filename)))
+        self._add_icons(icons)
+        
+        self.curseur.execute("INSERT INTO installed (id, root, stamp, installed_as) "
+                "VALUES (?, ?, ?, ?)", (id, root, self._get_installed_stamp(id), installed_as))
     
     def _set_repository_hash(self, uri, hash):
         """
@@ -519,6 +1188,244 @@ class database():
         """
         self.curseur.execute("UPDATE repositories SET hash = ? WHERE uri = ?", (hash, uri))
     
+    def _set_repository_index(self, uri, index_file, etag, last_modified):
+        """
+            Modifie le fichier d'index et les en-têtes HTTP associés à la
+            dernière version téléchargée d'un dépôt
+            
+            Arguments :
+                uri : Adresse du dépôt
+                index_file : Fichier d'index (repository.ini, repository.ini.gz
+                             ou repository.ini.xz)
+                etag : En-tête ETag
+                last_modified : En-tête Last-Modified
+        """
+        self.curseur.execute("UPDATE repositories SET index_file = ?, etag = ?, "
+                "last_modified = ? WHERE uri = ?",
+                (index_file, etag, last_modified, uri))
+    
+    def _update_applications(self, applications):
+        """
+            Modifie les informations d'applications (l'évaluation est
+            conservée)
+            
+            Arguments :
+                applications : liste de tuples (id, branch, repository,
+                               category, name, friendly_name,
+                               short_description, long_description, size_c,
+                               size_u, version, license, author, show, uri)
+                               (voir _add_applications)
+        """
+        self.curseur.executemany("UPDATE applications SET category = ?, name = ?, "
+                "friendly_name = ?, short_description = ?, "
+                "long_description = ?, size_c = ?, size_u = ?, version = ?, "
+                "license = ?, author = ?, show = ?, uri = ?, version_key = ? "
+                "WHERE id = ? AND branch = ? AND repository = ?",
+                [i[3:] + (version_key(i[10]),) + i[:3] for i in applications])
+    
+    def _update_category_counts(self):
+        """
+            Calcule le nombre d'applications de chaque catégorie (sous
+            catégories comprises)
+        """
+        self.curseur.execute("DELETE FROM category_counts")
+        # Les applications sont comptées dans la catégorie et ses ancêtres
+        self.curseur.execute("INSERT INTO category_counts (category, count) "
+                "SELECT category_tree.ancestor, COUNT(*) FROM category_tree "
+                "JOIN applications ON applications.category = category_tree.descendant "
+                "GROUP BY category_tree.ancestor")
+    
+    def _update_category_tree(self):
+        """
+            Calcule les ancêtres de chaque catégorie (table category_tree)
+        """
+        tree = []
+        for (id,) in self._query("SELECT id FROM categories"):
+            ancestor = id
+            while True:
+                tree.append((ancestor, id))
+                if ancestor == '':
+                    break
+                ancestor = get_category_parent(ancestor)
+        
+        self.curseur.execute("DELETE FROM category_tree")
+        self.curseur.executemany("INSERT OR IGNORE INTO category_tree "
+                "(ancestor, descendant) VALUES (?, ?)", tree)
+    
+    def _update_fuzzy_index(self, ids=None):
+        """
+            Calcule les trigrammes des identifiants et des noms des
+            applications (voir get_similar_applications)
+            
+            Arguments :
+                ids : Identifiants des applications ajoutées, modifiées ou
+                      supprimées, dont seuls les trigrammes sont calculés à
+                      nouveau (None pour calculer tout l'index)
+        """
+        if ids == None:
+            self.curseur.execute("DELETE FROM fuzzy_trigrams")
+            self.curseur.execute("DELETE FROM fuzzy_terms")
+            names = self._query("SELECT DISTINCT id, name FROM applications")
+        else:
+            ids = list(ids)
+            names = []
+            for start in xrange(0, len(ids), MAX_VARIABLES):
+                chunk = ids[start:start + MAX_VARIABLES]
+                marks = ', '.join('?' * len(chunk))
+                
+                self.curseur.execute("DELETE FROM fuzzy_trigrams WHERE term IN "
+                        "(SELECT id FROM fuzzy_terms WHERE application IN (%s))" % marks, chunk)
+                self.curseur.execute("DELETE FROM fuzzy_terms "
+                        "WHERE application IN (%s)" % marks, chunk)
+                names.extend(self._query("SELECT DISTINCT id, name FROM applications "
+                        "WHERE id IN (%s)" % marks, chunk))
+        
+        # Les nouveaux termes sont numérotés à la suite des termes conservés
+        last = self._query("SELECT COALESCE(MAX(id), 0) FROM fuzzy_terms")[0][0]
+        terms = []
+        trigrams = []
+        for application, name in names:
+            for term in set([application, name]):
+                term_trigrams = get_trigrams(term)
+                if term_trigrams:
+                    terms.append((last + len(terms) + 1, application, len(term_trigrams)))
+                    trigrams.extend((i, last + len(terms)) for i in term_trigrams)
+        
+        self.curseur.executemany("INSERT INTO fuzzy_terms (id, application, trigrams) "
+                "VALUES (?, ?, ?)", terms)
+        self.curseur.executemany("INSERT OR IGNORE INTO fuzzy_trigrams (trigram, term) "
+                "VALUES (?, ?)", trigrams)
+    
+    def _update_installed(self):
+        """
+            Met à jour les applications installées : seules celles dont les
+            fichiers de ./cache/installed ont été modifiés (ou dont le dossier
+            a été supprimé) sont lues à nouveau
+            
+            Renvoie : La liste des identifiants des applications lues ou
+                      supprimées
+        """
+        stored = dict((id, (root, stamp)) for id, root, stamp
+                      in self._query("SELECT id, root, stamp FROM installed"))
+        rootpath = self.get_config('rootpath')
+        workers = self.get_config('update_workers', 4)
+        
+        modified = []
+        for id in os.listdir('./cache/installed'):
+            root, stamp = stored.pop(id, (None, None))
+            if root == None or not os.path.isdir(root) \
+                    or stamp != self._get_installed_stamp(id):
+                logger.debug(u"Lecture des informations de l'application installée %s." % id)
+                self._scan_installed_application(id, rootpath, workers)
+                modified.append(id)
+        
+        for id in stored:
+            logger.debug(u"Suppression de l'application installée %s." % id)
+            self._remove_installed_application(id)
+            modified.append(id)
+        
+        return modified
+    
+    def _update_repository(self, uri, new_hash, index, cfg, applications):
+        """
+            Synchronise le contenu d'un dépôt dans la base de donnée : seules
+            les applications ajoutées, modifiées ou supprimées sont écrites
+            
+            Arguments :
+                uri : Adresse du dépôt
+                new_hash : Nouvelle somme md5 du dépôt
+                index : tuple (index_file, etag, last_modified) de la nouvelle
+                        version
+                cfg : Objet RepositoryParser associé au dépôt
+                applications : Liste des applications du dépôt
+            
+            Renvoie : L'ensemble des identifiants des applications ajoutées,
+                      supprimées ou dont les informations ont été modifiées
+        """
+        self._set_repository_hash(uri, new_hash)
+        self._set_repository_index(uri, *index)
+        
+        stored = self._get_repository_contents(uri)
+        
+        recommendations = cfg.recommendations
+        if recommendations != self.get_recommendations(uri):
+            logger.debug(u"Mise à jour des recommendations du dépôt.")
+            self.curseur.execute("DELETE FROM recommendations WHERE repository = ?", (uri,))
+            self._add_recommendations(uri, recommendations)
+        
+        logger.debug(u"Synchronisation des applications du dépôt.")
+        categories = set()
+        changed = set()
+        modified = []
+        new_applications = []
+        modified_applications = []
+        new_relations = {'links' : [], 'depends' : [], 'icons' : []}
+        modified_relations = {'links' : [], 'depends' : [], 'icons' : []}
+        for infos, links, depends, icons in applications:
+            id, branch = infos[0], infos[1]
+            key = (id, branch, uri)
+            categories.add(infos[3])
+            
+            old = stored.pop((id, branch), None)
+            if old == None:
+                logger.debug(u"Insertion de %s:%s." % (branch, id))
+                new_applications.append(infos + (0, -1))
+                changed.add(id)
+                old_links, old_depends, old_icons = [], [], []
+            else:
+                old_infos, old_links, old_depends, old_icons = old
+                if old_infos != infos[3:]:
+                    logger.debug(u"Modification de %s:%s." % (branch, id))
+                    modified_applications.append(infos)
+                    modified.append(key)
+                    changed.add(id)
+            
+            if old_links != links:
+                if old_links:
+                    modified_relations['links'].append(key)
+                new_relations['links'].extend(key + i for i in links)
+                modified.append(key)
+            
+            if old_depends != depends:
+                if old_depends:
+                    modified_relations['depends'].append(key)
+                new_relations['depends'].extend(key + (i,) for i in depends)
+                modified.append(key)
+            
+            if old_icons != [(size, hash) for size, icon_uri, hash in icons]:
+                if old_icons:
+                    modified_relations['icons'].append(key)
+                new_relations['icons'].extend(key + i for i in icons)
+                modified.append(key)
+        
+        # Adresses de toutes les icônes du dépôt, même de celles qui n'ont pas
+        # été modifiées
+        self.icon_store.add_uris([(icon_uri, hash) for infos, links, depends, icons
+                                  in applications for size, icon_uri, hash in icons])
+        self.icon_store.add_uris([(cfg.get('categories', category), hash) for category, hash
+                                  in cfg.sections['categories_hash'].items()])
+        
+        for id, branch in stored:
+            logger.debug(u"Suppression de %s:%s." % (branch, id))
+        self._remove_applications([(id, branch, uri) for id, branch in stored])
+        modified.extend((id, branch, uri) for id, branch in stored)
+        changed.update(id for id, branch in stored)
+        self.applications_cache.discard(modified)
+        
+        for table, applications in modified_relations.items():
+            self._remove_relations(table, applications)
+        
+        self._add_applications(new_applications)
+        self._update_applications(modified_applications)
+        self._add_links(new_relations['links'])
+        self._add_depends(new_relations['depends'])
+        self._add_icons(new_relations['icons'])
+        
+        for category in categories:
+            self._add_category(*get_category_cfg_infos(cfg, category))
+        
+        return changed
+    
     def add_repository(self, uri):
         """
             Ajoute un dépôt
@@ -536,13 +1443,40 @@ class database():
         """
         return self._query("SELECT count(id) FROM applications WHERE id = ?", (id,))[0][0] > 0
     
+    def check_indexes(self):
+        """
+            Vérifie que les requêtes exécutées à la création des objets
+            utilisent les index
+            
+            Renvoie : La liste des requêtes qui parcourent toute une table
+        """
+        scans = []
+        for query, data in INDEXED_QUERIES:
+            for detail in self.get_query_plan(query, data):
+                if detail.startswith('SCAN') and 'INDEX' not in detail:
+                    logger.warning(u"La requête \"%s\" n'utilise pas d'index (%s)." % (query, detail))
+                    scans.append(query)
+                    break
+        return scans
+    
+    def close(self):
+        """
+            Enregistre les données en attente et ferme la base de donnée
+        """
+        self.icon_store.flush()
+        self.connection.commit()
+        self.connection.close()
+    
     def count_applications(self, category):
         """
             Renvoie : Le nombre d'applications que contient la catégorie (et ses
                       sous catégories)
         """
-        return self._query("SELECT count(id) FROM applications "
-                "WHERE category LIKE ?", (category + "%",))[0][0]
+        try:
+            return self._query("SELECT count FROM category_counts "
+                    "WHERE category = ?", (category,))[0][0]
+        except IndexError:
+            return 0
     
     def get_application(self, id, branch=None, repository=None):
         """
@@ -553,25 +1487,106 @@ class database():
             
             Renvoie : l'application correspondante
         """
-        return Application(self, self._get_application_infos(id, branch, repository))
+        infos = self._get_application_infos(id, branch, repository)
+        application = self.applications_cache.get((infos['id'], infos['branch'], infos['repository']))
+        if application is None:
+            application = Application(self, infos)
+            self.applications_cache.add(application)
+        return application
     
-    def get_applications(self, category=''):
+    def get_applications(self, category='', prefetch=False):
         """
             Arguments :
                 category : Identifiant de la Catégorie (facultatif)
+                prefetch : True si les dépendances, icônes et liens des
+                           applications doivent être chargés immédiatement (en
+                           quelques requêtes), False s'ils sont chargés au
+                           premier accès
             
             Renvoie :
                 Les applications que contient la catégorie (et ses sous
                 catégories)
         """
-        applications = self._query("SELECT * FROM applications "
-                "WHERE category LIKE ?", (category + "%",))
-        return [Application(self, dict(i)) for i in applications]
+        if category == '':
+            applications = self._query("SELECT * FROM applications")
+        else:
+            applications = self._query("SELECT applications.* FROM category_tree "
+                    "JOIN applications ON applications.category = category_tree.descendant "
+                    "WHERE category_tree.ancestor = ?", (category,))
+        return self._get_applications(applications, prefetch)
+    
+    def get_applications_page(self, category='', sort='name', reverse=False,
+                              after=None, limit=50, branch=None,
+                              installed=None, prefetch=False):
+        """
+            Renvoie une page d'une liste triée d'applications. La page
+            suivante est obtenue en passant le curseur renvoyé comme argument
+            after : les applications précédentes ne sont ni relues ni créées.
+            
+            Arguments :
+                category : Identifiant de la Catégorie (facultatif)
+                sort : Tri ('name', 'rating' ou 'size')
+                reverse : True pour un tri décroissant
+                after : Curseur renvoyé avec la page précédente (None pour la
+                        première page)
+                limit : Nombre d'applications par page
+                branch : Branche des applications (toutes par défaut)
+                installed : True pour n'avoir que les applications
+                            installées, False pour n'avoir que celles qui ne
+                            le sont pas (toutes par défaut)
+                prefetch : True si les dépendances, icônes et liens des
+                           applications doivent être chargés immédiatement
+            
+            Renvoie : Un tuple (applications, cursor), cursor valant None s'il
+                      n'y a pas de page suivante
+        """
+        column, expression = SORT_COLUMNS[sort]
+        conditions = []
+        data = []
+        
+        if category:
+            conditions.append("category IN (SELECT descendant FROM category_tree "
+                              "WHERE ancestor = ?)")
+            data.append(category)
+        if branch != None:
+            conditions.append("branch = ?")
+            data.append(branch)
+        if installed != None:
+            conditions.append("id %s (SELECT id FROM applications WHERE repository = '')"
+                              % ('IN' if installed else 'NOT IN'))
+        
+        expressions = [expression] + SORT_KEY
+        if after != None:
+            # Applications qui suivent la dernière de la page précédente :
+            # (a, b, ...) > (x, y, ...) équivaut à a > x OR (a = x AND (b > y ...))
+            operator = '<' if reverse else '>'
+            condition = ''
+            condition_data = []
+            for i, value in reversed(zip(expressions, after)):
+                if not condition:
+                    condition = "%s %s ?" % (i, operator)
+                    condition_data = [value]
+                else:
+                    condition = "(%s %s ? OR (%s = ? AND %s))" % (i, operator, i, condition)
+                    condition_data = [value, value] + condition_data
+            conditions.append(condition)
+            data.extend(condition_data)
+        
+        order = ', '.join(i + (' DESC' if reverse else '') for i in expressions)
+        rows = self._query("SELECT * FROM applications%s ORDER BY %s LIMIT ?"
+                % (' WHERE ' + ' AND '.join(conditions) if conditions else '', order),
+                data + [limit])
+        
+        if len(rows) < limit:
+            cursor = None
+        else:
+            cursor = tuple(rows[-1][i] for i in [column] + SORT_KEY)
+        
+        return self._get_applications(rows, prefetch), cursor
     
     def get_categories(self):
         """Renvoie : La liste de toutes les catégories"""
-        categories = self._query("SELECT id FROM categories")
-        return map(lambda (a,):self.get_category(a), categories)
+        return self._get_categories(self._query("SELECT id, hash FROM categories"))
     
     def get_category(self, id):
         """
@@ -592,21 +1607,13 @@ class database():
                 La valeur de la propriété si elle existe
                 La valeur par défaut sinon
         """
-        self.curseur.execute("SELECT * FROM config WHERE name = ?", (name,))
-        value = self.curseur.fetchone()
+        if self.config == None:
+            self._load_config()
+        value = self.config.get(name)
         if value == None:
             return default
         else:
-            if value['value'] == None:
-                return default
-            elif value['value'].isdigit():
-                return int(value['value'])
-            elif value['value'].lower() == 'true':
-                return True
-            elif value['value'].lower() == 'false':
-                return False
-            else:
-                return value['value']
+            return value
     
     def get_depends(self, id, branch, repository):
         """
@@ -623,6 +1630,21 @@ class database():
         return map(lambda (a,):a, depends)
         
     
+    def get_file_owner(self, path):
+        """
+            Arguments :
+                path : Chemin d'un fichier, relatif au dossier rootpath
+            
+            Renvoie : L'identifiant de l'application qui a installé le
+                      fichier, None s'il n'a pas été installé par une
+                      application
+        """
+        try:
+            return self._query("SELECT application FROM manifest WHERE path = ?",
+                    (os.path.normpath(path).replace('\\', '/'),))[0][0]
+        except IndexError:
+            return None
+    
     def get_icon_hash(self, id, branch, repository, size):
         """
             Arguments :
@@ -653,9 +1675,36 @@ class database():
         """
         icons = self._query("SELECT size, hash FROM icons WHERE application = ? AND branch = ? AND repository = ?",
                     (id, branch, repository))
-        icons = map(lambda (a,b):(a,'./cache/icons/'+b+'.png'), icons)
+        icons = map(lambda (a,b):(a,self.icon_store.get(b)), icons)
         return dict(icons)
     
+    def get_installed_state(self, id):
+        """
+            Lit l'état d'une application installée dans l'index des
+            applications installées, sans accéder à ses fichiers. L'index est
+            mis à jour par update et refresh_installed_application.
+            
+            Arguments :
+                id : Identifiant de l'application
+            
+            Renvoie : None si l'application n'est pas installée, sinon un
+                      dictionnaire
+                state['branch'] : Branche de l'application installée
+                state['version'] : Version de l'application installée
+                state['installed_as'] : 'explicit' ou 'depend'
+                (branch et version valent None si les informations de
+                l'application sont incomplètes)
+        """
+        if self.installed_state == None:
+            # Une seule requête pour toutes les applications installées
+            self.installed_state = dict((i['id'], dict(i)) for i in self._query(
+                    "SELECT installed.id, branch, version, "
+                    "COALESCE(installed_as, 'explicit') AS installed_as "
+                    "FROM installed LEFT JOIN applications "
+                    "ON applications.id = installed.id "
+                    "AND applications.repository = ''"))
+        return self.installed_state.get(id)
+    
     def get_links(self, id, branch, repository):
         """
             Arguments :
@@ -670,6 +1719,49 @@ class database():
                            (id, branch, repository))
         return map(dict, links)
     
+    def get_manifest(self, id):
+        """
+            Arguments :
+                id : Identifiant de l'application
+            
+            Renvoie : La liste des fichiers installés par l'application, sous
+                      la forme de tuples (path, size, crc)
+        """
+        return [tuple(i) for i in self._query("SELECT path, size, crc "
+                "FROM manifest WHERE application = ? ORDER BY path", (id,))]
+    
+    def get_manifest_size(self, id):
+        """
+            Arguments :
+                id : Identifiant de l'application
+            
+            Renvoie : La taille des fichiers installés par l'application,
+                      None si ils ne sont pas connus
+        """
+        return self._query("SELECT SUM(size) FROM manifest "
+                "WHERE application = ?", (id,))[0][0]
+    
+    def get_query_plan(self, query, data=()):
+        """
+            Arguments :
+                query : Requête SQL
+                data : Paramètres de la requête
+            
+            Renvoie : La liste des étapes du plan d'exécution de la requête
+        """
+        return [i['detail'] for i in self._query("EXPLAIN QUERY PLAN " + query, data)]
+    
+    def get_recommendations(self, repository):
+        """
+            Arguments :
+                repository : Adresse du dépôt
+            
+            Renvoie : La liste des applications recommandées par le dépôt
+        """
+        recommendations = self._query("SELECT application FROM recommendations "
+                "WHERE repository = ? ORDER BY rowid", (repository,))
+        return map(lambda (a,):a, recommendations)
+    
     def get_required_by(self, id):
         """
             Arguments :
@@ -683,7 +1775,45 @@ class database():
     
     def get_repositories(self):
         """Renvoie : La liste des dépôts"""
-        return self._query('SELECT uri, hash FROM repositories')
+        return self._query('SELECT uri, hash, index_file, etag, last_modified '
+                           'FROM repositories')
+    
+    def get_similar_applications(self, text, limit=5):
+        """
+            Recherche approximative (tolérant les fautes de frappe) d'une
+            application à partir de son identifiant ou de son nom : les
+            applications sont classées selon la proportion de trigrammes
+            communs (indice de Jaccard)
+            
+            Arguments :
+                text : Identifiant ou nom approximatif (par exemple "firefx")
+                limit : Nombre maximal de résultats
+            
+            Renvoie : Les applications les plus proches, la plus proche en
+                      premier
+        """
+        trigrams = list(get_trigrams(text))
+        if not trigrams:
+            return []
+        
+        similar = []
+        scores = self._query("SELECT application, MAX(similarity) AS similarity "
+                "FROM (SELECT fuzzy_terms.application AS application, "
+                "COUNT(*) * 1.0 / (? + fuzzy_terms.trigrams - COUNT(*)) AS similarity "
+                "FROM fuzzy_trigrams JOIN fuzzy_terms ON fuzzy_terms.id = fuzzy_trigrams.term "
+                "WHERE fuzzy_trigrams.trigram IN (%s) GROUP BY fuzzy_trigrams.term) "
+                "WHERE similarity >= ? GROUP BY application "
+                "ORDER BY similarity DESC, application" % ', '.join('?' * len(trigrams)),
+                [len(trigrams)] + trigrams + [SIMILARITY_THRESHOLD])
+        for id, similarity in scores:
+            try:
+                similar.append(self.get_application(id))
+            except NoSuchApplication:
+                continue
+            if len(similar) >= limit:
+                break
+        
+        return similar
     
     def get_subcategories(self, id=''):
         """
@@ -691,7 +1821,81 @@ class database():
                 id : Identifiant de la catégorie
             
             Renvoie : Les sous catégories"""
-        return [i for i in self.get_categories() if get_category_parent(i) == id]
+        return self._get_categories(self._query("SELECT id, hash FROM categories "
+                "WHERE parent = ?", (id,)))
+    
+    def get_upgradable_applications(self, prefetch=False):
+        """
+            Recherche en une requête les applications installées dont une
+            version plus récente (ou la même version dans une branche plus
+            stable) est disponible dans les dépôts, en comparant les clés de
+            version enregistrées
+            
+            Arguments :
+                prefetch : True si les dépendances, icônes et liens des
+                           applications doivent être chargés immédiatement
+            
+            Renvoie : La liste des meilleures mises à jour disponibles (une
+                      Application des dépôts par application installée)
+        """
+        applications = self._query("SELECT candidate.* FROM installed "
+                "JOIN applications AS local ON local.id = installed.id "
+                "AND local.repository = '' "
+                "JOIN applications AS candidate ON candidate.rowid = ("
+                    "SELECT rowid FROM applications "
+                    "WHERE id = installed.id AND repository != '' "
+                    "ORDER BY version_key DESC, %s DESC LIMIT 1) "
+                "WHERE candidate.version_key > local.version_key "
+                "OR (candidate.version_key = local.version_key AND %s > %s) "
+                "ORDER BY candidate.id" % (BRANCH_RANK % 'branch',
+                                           BRANCH_RANK % 'candidate.branch',
+                                           BRANCH_RANK % 'local.branch'))
+        return self._get_applications(applications, prefetch)
+    
+    def iter_applications(self, category='', sort='name', reverse=False,
+                          page_size=50, **filters):
+        """
+            Parcourt une liste triée d'applications, page par page (voir
+            get_applications_page)
+            
+            Arguments :
+                category : Identifiant de la Catégorie (facultatif)
+                sort : Tri ('name', 'rating' ou 'size')
+                reverse : True pour un tri décroissant
+                page_size : Nombre d'applications lues à la fois
+                filters : Arguments branch, installed et prefetch de
+                          get_applications_page
+        """
+        cursor = None
+        while True:
+            applications, cursor = self.get_applications_page(category, sort,
+                    reverse, cursor, page_size, **filters)
+            for application in applications:
+                yield application
+            if cursor == None:
+                break
+    
+    def refresh_installed_application(self, id):
+        """
+            Met à jour les informations d'une application qui vient d'être
+            installée, mise à jour ou désinstallée
+            
+            Arguments :
+                id : Identifiant de l'application
+        """
+        self._scan_installed_application(id, self.get_config('rootpath'),
+                                         self.get_config('update_workers', 4))
+        self.applications_cache.discard_repository('')
+        self.applications_cache.discard_relation('required_by')
+        
+        self._update_category_tree()
+        self._update_category_counts()
+        self._remove_empty_categories()
+        self._update_fuzzy_index([id])
+        
+        # Icônes de l'application, ajoutées à l'index des icônes
+        self.icon_store.wait()
+        self.connection.commit()
     
     def remove_category(self, id):
         """
@@ -701,6 +1905,53 @@ class database():
                 id : Identifiant de la catégorie
         """
         self.curseur.execute("DELETE FROM categories WHERE id = ?", (id,))
+        self.curseur.execute("DELETE FROM category_tree WHERE descendant = ?", (id,))
+    
+    def search(self, text, limit=50, offset=0, prefetch=False):
+        """
+            Recherche des applications à partir de leur nom, de leur
+            description ou de leur auteur
+            
+            Arguments :
+                text : Texte recherché (les applications contenant tous les
+                       mots, ou des mots qui commencent par ceux-ci, sont
+                       renvoyées)
+                limit : Nombre maximal de résultats
+                offset : Nombre de résultats à ignorer (pagination)
+                prefetch : True si les dépendances, icônes et liens des
+                           applications doivent être chargés immédiatement
+            
+            Renvoie : Les applications trouvées, les plus pertinentes en
+                      premier
+        """
+        words = re.findall(r'\w+', text, re.UNICODE)
+        if not words:
+            return []
+        
+        if self.search_module == None:
+            # Pas d'index : recherche (lente) de chaque mot dans chaque colonne
+            condition = '(%s)' % ' OR '.join('%s LIKE ?' % name for name, weight in SEARCH_COLUMNS)
+            data = []
+            for word in words:
+                data.extend(['%' + word + '%'] * len(SEARCH_COLUMNS))
+            rows = self._query("SELECT * FROM applications WHERE %s "
+                    "ORDER BY name COLLATE unicode LIMIT ? OFFSET ?"
+                    % ' AND '.join([condition] * len(words)),
+                    data + [limit, offset])
+        else:
+            if self.search_module == 'fts5':
+                query = ' '.join('"%s"*' % word for word in words)
+                rank = "bm25(applications_fts, %s)" % ', '.join(str(weight) for name, weight in SEARCH_COLUMNS)
+            else:
+                query = ' '.join('"%s*"' % word for word in words)
+                # FTS4 ne fournit pas de fonction de classement
+                rank = "applications.name COLLATE unicode"
+            rows = self._query("SELECT applications.* FROM applications_fts "
+                    "JOIN applications ON applications.rowid = applications_fts.rowid "
+                    "WHERE applications_fts MATCH ? ORDER BY %s LIMIT ? OFFSET ?" % rank,
+                    (query, limit, offset))
+        
+        return self._get_applications(rows, prefetch)
     
     def set_config(self, name, value):
         """
@@ -715,6 +1966,27 @@ class database():
             self._execute("INSERT INTO config (name, value) VALUES (?, ?)", (name, str(value)))
         else:
             self._execute("UPDATE config SET value = ? WHERE name = ?", (str(value), name))
+        
+        if self.config != None:
+            self.config[name] = parse_config_value(str(value))
+    
+    def set_manifest(self, id, files):
+        """
+            Enregistre (ou supprime) la liste des fichiers installés par une
+            application
+            
+            Arguments :
+                id : Identifiant de l'application
+                files : Liste de tuples (path, size, crc), les chemins étant
+                        relatifs au dossier rootpath (liste vide pour
+                        supprimer le manifeste)
+        """
+        self.curseur.execute("DELETE FROM manifest WHERE application = ?", (id,))
+        self.curseur.executemany("INSERT OR REPLACE INTO manifest "
+                "(application, path, size, crc) VALUES (?, ?, ?, ?)",
+                [(id, os.path.normpath(path).replace('\\', '/'), size, crc)
+                 for path, size, crc in files])
+        self.connection.commit()
     
     def set_rating(self, id, branch, repository, rating, votes):
         """
@@ -742,78 +2014,62 @@ class database():
                     False sinon
         """
         logger.info(u"Mise à jour des dépôts.")
-        for repository in self.get_repositories():
+        self._check_config_version()
+        repositories = [(i['uri'], i['hash'], i['index_file'], i['etag'],
+                         i['last_modified'], force)
+                        for i in self.get_repositories()]
+        
+        # Les dépôts sont téléchargés et lus en parallèle, seules les écritures
+        # dans la base de donnée sont effectuées dans ce thread
+        workers = min(self.get_config('update_workers', 4), len(repositories))
+        if workers > 1:
+            pool = ThreadPool(workers)
+            results = pool.imap_unordered(fetch_repository, repositories)
+        else:
+            pool = None
+            results = imap(fetch_repository, repositories)
+        
+        # Les dépôts, les applications installées et les tables qui en sont
+        # déduites (catégories, trigrammes) sont modifiés dans une seule
+        # transaction : elles ne peuvent pas être validées séparément
+        with self._bulk_load():
+            # Applications ajoutées, supprimées ou modifiées
+            changed = set()
+            
             try:
-                new_hash = urllib2.urlopen(repository['uri'] + '/repository.ini.hash').read()
-            except (urllib2.URLError, urllib2.HTTPError):
-                new_hash = None
+                for uri, new_hash, index, cfg, applications, error in results:
+                    if error is not None:
+                        logger.warning(u"Le dépôt %s n'a pas pu être mis à jour." % uri)
+                    elif cfg is None:
+                        logger.debug(u"Le dépôt %s n'a pas été modifié." % uri)
+                    else:
+                        logger.debug(u"Le dépôt %s a été modifié (ou la mise à jour a été forcée).", uri)
+                        changed.update(self._update_repository(uri, new_hash, index, cfg, applications))
+            finally:
+                if pool is not None:
+                    pool.close()
+                    pool.join()
             
-            if repository['hash'] == new_hash and not force:
-                logger.debug(u"Le dépôt %s n'a pas été modifié." % repository['uri'])
-            else:
-                logger.debug(u"Le dépôt %s a été modifié (ou la mise à jour a été forcée).", repository['uri'])
-                self._set_repository_hash(repository['uri'], new_hash)
-                
-                logger.debug(u"Suppression des anciennes applications du dépôt.")
-                self._remove_all_from_repository(repository['uri'])
-                
-                cfg = get_repository_cfg(repository['uri'])
-                
-                logger.debug(u"Insertion des recommendations du dépôt.")
-                
-                for recommendation in cfg.getlist('repository', 'recommendation'):
-                    self._add_recommendation(repository['uri'], recommendation)
-                
-                logger.debug(u"Insertion des applications du dépôt.")
-                for section in cfg.sections():
-                    if section not in ['repository', 'categories', 'categories_hash']:
-                        logger.debug(u"Insertion de %s." % section)
-                        try:
-                            branch, id = tuple(section.split(":", 1))
-                            self._add_application(*get_application_cfg_infos(cfg, section, repository['uri']))
-                            self._add_category(*get_category_cfg_infos(cfg, cfg.get(section, 'category')))
-                            
-                            for name,uri in zip(cfg.getlist(section, 'link%d_name'),cfg.getlist(section, 'link')):
-                                self._add_link(id, branch, repository['uri'], name, uri)
-                            
-                            for depend in cfg.getlist(section, 'depend'):
-                                self._add_depend(id, branch, repository['uri'], depend)
-                            
-                            for size in [32,48,64,128]:
-                                if cfg.has_option(section, 'icon_%d'%size):
-                                    self._add_icon(id, branch, repository['uri'], size, cfg.get(section, 'icon_%d'%size), cfg.get(section, 'icon_%d_hash'%size))
-                            
-                        except (NoSectionError, NoOptionError):
-                            logger.warning(u"Les informations de l'application %s du dépôt %s sont incomplète." % (section,repository['uri']))
-        
-        
-        logger.info(u"Recherche des applications installées.")
-        
-        logger.debug(u"Suppression des applications installées de la base de donnée.")
-        self._remove_all_from_repository('')
-        
-        logger.debug(u"Insertion des applications installées.")
-        for id in os.listdir('./cache/installed'):
-            infos, links, depends = self._get_installed_application_cfg_infos(id)
-            if infos:
-                self._add_application(*infos)
-                self._add_category(infos[3])
-                
-                for title, uri in links:
-                    self._add_link(id, infos[1], u'', title, uri)
-                
-                for depend in depends:
-                    self._add_depend(id, infos[1], u'', depend)
-                
-                for size in [32,48,64,128]:
-                    filename = './cache/installed/%s/appicon_%d.png' % (id, size)
-                    if os.path.isfile(filename):
-                        self._add_icon(id, infos[1], u'', size, filename, md5file(filename))
-        
-        self.connection.commit()
+            logger.info(u"Recherche des applications installées.")
+            
+            installed = self._update_installed()
+            if installed:
+                self.applications_cache.discard_repository('')
+                # Les applications installées qui dépendent de chaque
+                # application ont pu changer
+                self.applications_cache.discard_relation('required_by')
+                changed.update(installed)
+            
+            if changed:
+                # Des applications ont été ajoutées, supprimées ou déplacées
+                self._update_category_tree()
+                self._update_category_counts()
+                self._remove_empty_categories()
+                self._update_fuzzy_index(changed)
         
-        self._remove_empty_categories()
-        self._remove_old_icons()
+        logger.debug(u"Attente de la fin du téléchargement des icônes.")
+        self.icon_store.wait()
+        self.icon_store.collect(self.get_config('icons_max_size', 0))
         
         self.connection.commit()
         logger.info(u"Fin de la mise à jour des dépôts.")
@@ -9,12 +9,91 @@ import hashlib
 from distutils import version
 import stat
 import sys
+import unicodedata
+from multiprocessing.pool import ThreadPool
 
-def cmp_version(a,b):
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        # Parcours plus lent, avec os.listdir et os.lstat
+        scandir = None
+
+class DecompressedStream(object):
     """
-        Compare deux chaînes représentant une version.
+        Objet fichier (en lecture seule) décompressant à la volée le contenu
+        d'un autre objet fichier, sans le charger entièrement en mémoire.
     """
-    return -cmp(version.LooseVersion(a), version.LooseVersion(b))
+    def __init__(self, fileobj, decompressor=None, chunk_size=2**16):
+        """
+            Arguments :
+                fileobj : Objet fichier contenant les données compressées
+                decompressor : Objet possédant une méthode decompress (par
+                               exemple zlib.decompressobj()), None si les
+                               données ne sont pas compressées
+                chunk_size : Taille des blocs lus dans fileobj
+        """
+        self.fileobj = fileobj
+        self.decompressor = decompressor
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+    
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                break
+            yield line
+    
+    def _fill(self):
+        """
+            Ajoute un bloc de données décompressées au tampon
+        """
+        data = self.fileobj.read(self.chunk_size)
+        if data:
+            if self.decompressor != None:
+                data = self.decompressor.decompress(data)
+        else:
+            self.eof = True
+            if hasattr(self.decompressor, 'flush'):
+                data = self.decompressor.flush()
+        
+        self.buffer = self.buffer[self.position:] + data
+        self.position = 0
+    
+    def close(self):
+        self.fileobj.close()
+    
+    def read(self, size=-1):
+        while not self.eof and (size < 0 or len(self.buffer) - self.position < size):
+            self._fill()
+        
+        if size < 0:
+            end = len(self.buffer)
+        else:
+            end = min(self.position + size, len(self.buffer))
+        data = self.buffer[self.position:end]
+        self.position = end
+        return data
+    
+    def readline(self):
+        end = self.buffer.find('\n', self.position)
+        while end < 0 and not self.eof:
+            start = len(self.buffer) - self.position
+            self._fill()
+            end = self.buffer.find('\n', start)
+        
+        if end < 0:
+            end = len(self.buffer)
+        else:
+            end += 1
+        line = self.buffer[self.position:end]
+        self.position = end
+        return line
 
 def get_free_space(folder):
     """
@@ -32,19 +111,72 @@ def get_free_space(folder):
         s = os.statvfs(folder)
         return s.f_bsize * s.f_bavail
 
-def get_size(path):
+def _get_tree_size(path, cache=None):
     """
-        Renvoie : la taille du dossier ou fichier path
+        Renvoie : la taille du dossier path (les dossiers illisibles sont
+                  ignorés, comme avec os.walk)
     """
     size = 0
+    directories = [path]
+    while directories:
+        try:
+            files_size, subdirectories = _scan_directory(directories.pop(), cache)
+        except OSError:
+            continue
+        size += files_size
+        directories.extend(subdirectories)
+    return size
+
+def get_size(path, workers=1, cache=None):
+    """
+        Arguments :
+            path : Chemin d'un dossier ou fichier
+            workers : Nombre de sous dossiers parcourus en parallèle
+            cache : Dictionnaire (facultatif) conservant la taille des
+                    fichiers de chaque dossier d'un appel à l'autre, tant que
+                    la date de modification du dossier ne change pas (la
+                    modification d'un fichier existant n'est alors pas prise
+                    en compte)
+        
+        Renvoie : la taille du dossier ou fichier path
+    """
     if os.path.isfile(path):
-        size = os.path.getsize(path)
-    elif os.path.isdir(path):
-        for dirpath, dirnames, filenames in os.walk(path):
-            for filename in filenames:
-                size += os.path.getsize(os.path.join(dirpath, filename))
+        return os.path.getsize(path)
+    elif not os.path.isdir(path):
+        return 0
+    
+    size, directories = _scan_directory(path, cache)
+    if workers > 1 and len(directories) > 1:
+        pool = ThreadPool(min(workers, len(directories)))
+        try:
+            size += sum(pool.map(lambda i: _get_tree_size(i, cache), directories))
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        size += sum(_get_tree_size(i, cache) for i in directories)
     return size
 
+def get_trigrams(text):
+    """
+        Arguments :
+            text : Chaîne de caractères
+        
+        Renvoie : L'ensemble des trigrammes de la chaîne, après suppression
+                  des accents, de la ponctuation et des espaces (par exemple
+                  "Libre Office" et "libreoffice" ont les mêmes trigrammes)
+    """
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    text = unicodedata.normalize('NFKD', text).lower()
+    text = u''.join(c for c in text if c.isalnum() and not unicodedata.combining(c))
+    if not text:
+        return set()
+    
+    # Les espaces ajoutés favorisent les chaînes qui ont le même début
+    text = u'  ' + text + u' '
+    return set(text[i:i+3] for i in xrange(len(text) - 2))
+
 def md5file(path):
     """
         Renvoie la somme md5 du fichier path
@@ -69,9 +201,7 @@ def rmtree(path, ignore_errors=False, callback=None, exclude=[], onerror=None, f
     is false and onerror is None, an exception is raised.
     """
     if foldersize == 0 and os.path.isdir(path):
-        for (folder, dirs, files) in os.walk(path):
-            for file in files:
-                foldersize += os.path.getsize(os.path.join(folder, file))
+        foldersize = get_size(path)
     
     if callback is None:
         callback = lambda a,b : None
@@ -117,11 +247,83 @@ def rmtree(path, ignore_errors=False, callback=None, exclude=[], onerror=None, f
         
     return delsize
 
+def _scan_directory(path, cache=None):
+    """
+        Arguments :
+            path : Chemin d'un dossier
+            cache : Dictionnaire conservant le résultat pour chaque dossier,
+                    tant que sa date de modification ne change pas
+        
+        Renvoie : Un tuple (size, directories)
+            size : Taille des fichiers du dossier (sans les sous dossiers)
+            directories : Liste des chemins des sous dossiers
+    """
+    if cache != None:
+        mtime = os.stat(path).st_mtime
+        if path in cache and cache[path][0] == mtime:
+            return cache[path][1:]
+    
+    size = 0
+    directories = []
+    if scandir != None:
+        # Les informations des fichiers sont fournies avec le contenu du
+        # dossier (sans appel à stat sous Windows)
+        for entry in scandir(path):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    directories.append(entry.path)
+                elif not entry.is_dir():
+                    # Comme avec os.walk, les liens symboliques vers des
+                    # fichiers sont suivis, ceux vers des dossiers ignorés
+                    size += entry.stat().st_size
+            except OSError:
+                pass
+    else:
+        for name in os.listdir(path):
+            try:
+                infos = os.lstat(os.path.join(path, name))
+                if stat.S_ISLNK(infos.st_mode):
+                    infos = os.stat(os.path.join(path, name))
+                    if stat.S_ISDIR(infos.st_mode):
+                        continue
+                elif stat.S_ISDIR(infos.st_mode):
+                    directories.append(os.path.join(path, name))
+                    continue
+            except OSError:
+                continue
+            size += infos.st_size
+    
+    if cache != None:
+        cache[path] = (mtime, size, directories)
+    return size, directories
+
+def version_key(vstring):
+    """
+        Arguments :
+            vstring : Chaîne représentant une version
+        
+        Renvoie : Une chaîne dont l'ordre (octet par octet) est celui des
+                  versions LooseVersion correspondantes : les nombres sont
+                  précédés de 'a' et de leur nombre de chiffres, les autres
+                  composantes de 'b' (en python 2, un nombre est inférieur à
+                  une chaîne), les composantes sont séparées par '\\x01'.
+    """
+    key = []
+    for component in getattr(version.LooseVersion(vstring), 'version', []):
+        if isinstance(component, (int, long)):
+            component = str(component)
+            key.append(u'a%02d%s' % (len(component), component))
+        else:
+            key.append(u'b' + component)
+    return u'\x01'.join(key)
+
 def zipextractall(zip, path=None, callback=None, members=None, pwd=None, exclude=[]):
     """Extract all members from the archive to the current working
        directory. `path' specifies a different directory to extract to.
        `members' is optional and must be a subset of the list returned
        by namelist().
+       
+       Return a list of (name, size, crc) tuples for the extracted files.
     """
     zip = zipfile.ZipFile(zip, 'r')
     
@@ -141,9 +343,15 @@ def zipextractall(zip, path=None, callback=None, members=None, pwd=None, exclude
         zipsize += infos.file_size
     dirsize = 0
     
+    extracted = []
     for zipinfo in members:
         zip.extract(zipinfo, path, pwd)
-        dirsize += zip.getinfo(zipinfo).file_size
+        infos = zip.getinfo(zipinfo)
+        dirsize += infos.file_size
+        if not infos.filename.endswith('/'):
+            extracted.append((infos.filename, infos.file_size, infos.CRC))
         callback(dirsize, zipsize)
 
     zip.close()
+    
+    return extracted
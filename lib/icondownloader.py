@@ -0,0 +1,107 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger('synapps')
+
+import os
+import shutil
+import tempfile
+import urllib2
+from multiprocessing.pool import ThreadPool
+
+def download_icon(uri, filename):
+    """
+        Télécharge une icône. Le fichier est d'abord écrit dans un fichier
+        temporaire du même dossier, puis renommé : filename n'existe jamais
+        sous une forme incomplète.
+        
+        Arguments :
+            uri : Adresse de l'icône (ou chemin d'un fichier local)
+            filename : Chemin de l'icône dans le cache
+        
+        Renvoie : La taille de l'icône, None si elle n'a pas pu être
+                  téléchargée
+    """
+    directory = os.path.dirname(filename)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+    except OSError:
+        # Le dossier a été créé par un autre thread
+        pass
+    
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if os.path.isfile(uri):
+                with open(uri, 'rb') as src:
+                    shutil.copyfileobj(src, f)
+            else:
+                shutil.copyfileobj(urllib2.urlopen(uri), f)
+        os.rename(tmp, filename)
+    except (urllib2.URLError, urllib2.HTTPError, ValueError, IOError, OSError):
+        logger.warning(u"Impossible de télécharger l'icône %s." % uri)
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+        return None
+    
+    return os.path.getsize(filename)
+
+class IconDownloader(object):
+    """
+        Télécharge les icônes manquantes en parallèle, pendant que la base de
+        donnée est mise à jour. Chaque icône (identifiée par sa somme md5)
+        n'est téléchargée qu'une fois, même si elle est utilisée par plusieurs
+        applications.
+    """
+    def __init__(self, path, workers=4):
+        """
+            Arguments :
+                path : Fonction renvoyant le chemin d'une icône à partir de sa
+                       somme md5
+                workers : Nombre maximal de téléchargements simultanés
+        """
+        self.path = path
+        self.workers = workers
+        self.pool = None
+        self.queued = {}
+    
+    def download(self, uri, hash):
+        """
+            Ajoute une icône à la file des téléchargements si elle n'est pas
+            déjà dans le cache
+            
+            Arguments :
+                uri : Adresse de l'icône
+                hash : Somme md5 de l'icône
+        """
+        filename = self.path(hash)
+        if hash in self.queued or os.path.isfile(filename):
+            return
+        
+        if self.pool == None:
+            self.pool = ThreadPool(max(self.workers, 1))
+        self.queued[hash] = (uri, self.pool.apply_async(download_icon, (uri, filename)))
+    
+    def wait(self):
+        """
+            Attend la fin des téléchargements en cours
+            
+            Renvoie : La liste des icônes téléchargées, sous la forme de tuples
+                      (hash, uri, size)
+        """
+        if self.pool != None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        
+        downloaded = []
+        for hash, (uri, result) in self.queued.items():
+            size = result.get()
+            if size != None:
+                downloaded.append((hash, uri, size))
+        self.queued.clear()
+        
+        return downloaded
@@ -0,0 +1,233 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger('synapps')
+
+import os
+import time
+
+from icondownloader import IconDownloader, download_icon
+
+class IconStore(object):
+    """
+        Cache des icônes, adressées par leur somme md5.
+        
+        Les icônes sont rangées dans des sous-dossiers (./cache/icons/ab/ab...png)
+        et indexées dans la table icon_files de la base de donnée (adresse,
+        taille et date du dernier accès). Lorsque la taille du cache dépasse le
+        budget (propriété icons_max_size, en octets, 0 pour ne pas limiter), les
+        icônes les moins récemment utilisées sont supprimées ; elles seront
+        téléchargées à nouveau lorsqu'elles seront affichées.
+    """
+    def __init__(self, database, directory='./cache/icons', workers=4):
+        """
+            Arguments :
+                database : Base de donnée
+                directory : Dossier des icônes
+                workers : Nombre maximal de téléchargements simultanés
+        """
+        self.database = database
+        self.directory = directory
+        self.downloader = IconDownloader(self.path, workers)
+        
+        # Dates des derniers accès, enregistrées dans la base par flush()
+        self.accessed = {}
+        
+        # Adresses des icônes demandées depuis la dernière mise à jour
+        self.uris = {}
+        
+        # Icônes supprimées du disque pour respecter le budget
+        self.evicted = set(i for (i,) in database._query(
+                "SELECT hash FROM icon_files WHERE size IS NULL"))
+    
+    def _index(self, icons):
+        """
+            Ajoute à l'index des icônes qui sont déjà dans le cache, sans
+            modifier celles qui y sont déjà
+            
+            Arguments :
+                icons : Liste de tuples (hash, uri, size)
+        """
+        now = int(time.time())
+        self.database.curseur.executemany("INSERT OR IGNORE INTO icon_files "
+                "(hash, uri, size, last_access) VALUES (?, ?, ?, ?)",
+                [i + (now,) for i in icons])
+    
+    def _remove_file(self, hash):
+        """Supprime le fichier d'une icône"""
+        filename = self.path(hash)
+        if os.path.isfile(filename):
+            os.remove(filename)
+    
+    def add_uris(self, uris):
+        """
+            Enregistre les adresses d'icônes, sans les télécharger : les
+            icônes du cache dont l'adresse n'était pas connue (importées par
+            import_directory) peuvent ensuite être supprimées pour respecter
+            le budget
+            
+            Arguments :
+                uris : Liste de tuples (uri, hash)
+        """
+        self.uris.update((hash, uri) for uri, hash in uris if uri and hash)
+    
+    def collect(self, budget=0):
+        """
+            Supprime les icônes qui ne sont plus utilisées, puis les icônes les
+            moins récemment utilisées si la taille du cache dépasse le budget
+            
+            Arguments :
+                budget : Taille maximale du cache en octets (0 pour ne pas
+                         limiter)
+        """
+        self.flush()
+        
+        unused = self.database._query("SELECT hash FROM icon_files "
+                "WHERE hash NOT IN (SELECT hash FROM icons) "
+                "AND hash NOT IN (SELECT hash FROM categories)")
+        for (hash,) in unused:
+            self._remove_file(hash)
+        self.database.curseur.executemany("DELETE FROM icon_files WHERE hash = ?", unused)
+        self.evicted.difference_update(i for (i,) in unused)
+        
+        if budget > 0:
+            total = self.database._query("SELECT COALESCE(SUM(size), 0) "
+                    "FROM icon_files")[0][0]
+            if total > budget:
+                evicted = []
+                # Seules les icônes dont l'adresse est connue peuvent être
+                # téléchargées à nouveau
+                for hash, size in self.database._query("SELECT hash, size "
+                        "FROM icon_files WHERE size IS NOT NULL "
+                        "AND uri IS NOT NULL ORDER BY last_access"):
+                    if total <= budget:
+                        break
+                    self._remove_file(hash)
+                    evicted.append((hash,))
+                    total -= size
+                
+                logger.debug(u"Suppression de %d icônes pour respecter le budget du cache." % len(evicted))
+                self.database.curseur.executemany("UPDATE icon_files SET size = NULL "
+                        "WHERE hash = ?", evicted)
+                self.evicted.update(i for (i,) in evicted)
+        
+        self.database.connection.commit()
+    
+    def download(self, uri, hash):
+        """
+            Télécharge une icône (en arrière plan) si elle n'est pas dans le
+            cache
+            
+            Arguments :
+                uri : Adresse de l'icône
+                hash : Somme md5 de l'icône
+        """
+        self.uris[hash] = uri
+        self.downloader.download(uri, hash)
+    
+    def flush(self):
+        """
+            Enregistre les dates des derniers accès dans la base de donnée
+        """
+        self.database.curseur.executemany("UPDATE icon_files SET last_access = ? "
+                "WHERE hash = ?", [(t, h) for h, t in self.accessed.items()])
+        self.accessed.clear()
+    
+    def get(self, hash):
+        """
+            Arguments :
+                hash : Somme md5 de l'icône
+            
+            Renvoie : Le chemin de l'icône (qui est téléchargée à nouveau si
+                      elle a été supprimée pour respecter le budget)
+        """
+        filename = self.path(hash)
+        self.accessed[hash] = int(time.time())
+        
+        if hash in self.evicted:
+            uri = self.database._query("SELECT uri FROM icon_files "
+                    "WHERE hash = ?", (hash,))[0][0]
+            size = download_icon(uri, filename)
+            if size != None:
+                self.evicted.discard(hash)
+                self.database._execute("UPDATE icon_files SET size = ? "
+                        "WHERE hash = ?", (size, hash))
+        
+        return filename
+    
+    def import_directory(self):
+        """
+            Range les icônes enregistrées à la racine du dossier (versions
+            précédentes) dans les sous-dossiers, puis ajoute à l'index toutes
+            les icônes du cache qui n'y sont pas (la base de donnée a pu être
+            supprimée)
+        """
+        if not os.path.isdir(self.directory):
+            return
+        
+        icons = []
+        for filename in os.listdir(self.directory):
+            src = os.path.join(self.directory, filename)
+            if os.path.isdir(src):
+                # Icônes déjà rangées
+                for name in os.listdir(src):
+                    hash, ext = os.path.splitext(name)
+                    if ext == '.png' and os.path.join(src, name) == self.path(hash):
+                        icons.append((hash, None, os.path.getsize(self.path(hash))))
+                continue
+            if not os.path.isfile(src):
+                continue
+            
+            hash, ext = os.path.splitext(filename)
+            if ext != '.png' or not hash:
+                os.remove(src)
+                continue
+            
+            dst = self.path(hash)
+            if not os.path.isdir(os.path.dirname(dst)):
+                os.makedirs(os.path.dirname(dst))
+            os.rename(src, dst)
+            icons.append((hash, None, os.path.getsize(dst)))
+        
+        self._index(icons)
+    
+    def path(self, hash):
+        """
+            Renvoie : Le chemin de l'icône dont la somme md5 est hash
+        """
+        return os.path.join(self.directory, hash[:2], hash + '.png')
+    
+    def register(self, icons):
+        """
+            Ajoute des icônes à l'index
+            
+            Arguments :
+                icons : Liste de tuples (hash, uri, size)
+        """
+        now = int(time.time())
+        self.database.curseur.executemany("INSERT OR REPLACE INTO icon_files "
+                "(hash, uri, size, last_access) VALUES (?, ?, ?, ?)",
+                [i + (now,) for i in icons])
+        self.evicted.difference_update(i[0] for i in icons)
+    
+    def wait(self):
+        """
+            Attend la fin des téléchargements en cours et ajoute les icônes
+            téléchargées à l'index
+        """
+        self.register(self.downloader.wait())
+        
+        # Icônes qui étaient déjà dans le cache sans être dans l'index (base de
+        # donnée recréée, arrêt avant la validation des téléchargements...)
+        indexed = set(i for (i,) in self.database._query("SELECT hash FROM icon_files"))
+        self._index([(hash, uri, os.path.getsize(self.path(hash)))
+                     for hash, uri in self.uris.items()
+                     if hash not in indexed and os.path.isfile(self.path(hash))])
+        
+        # Adresses des icônes qui étaient déjà dans le cache
+        self.database.curseur.executemany("UPDATE icon_files SET uri = ? "
+                "WHERE hash = ? AND uri IS NULL",
+                [(u, h) for h, u in self.uris.items()])
+        self.uris.clear()
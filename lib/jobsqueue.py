@@ -1,13 +1,24 @@
 #!/usr/bin/python2
 # -*- coding: utf-8 -*-
 
+import logging
+
+logger = logging.getLogger('synapps')
+
+import sys
 from collections import deque
 
 from exceptions import *
 
 class JobsQueue(deque):
     """File d'attente (FIFO) contenant les opérations à effectuer."""
-    def __init__(self):
+    def __init__(self, database):
+        """
+            Arguments :
+                database : Base de donnée, dont l'index des applications
+                           installées est mis à jour après chaque opération
+        """
+        self.database = database
         self.current_job = None
         
         deque.__init__(self)
@@ -142,12 +153,30 @@ class JobsQueue(deque):
         # Modifie l'opération courante
         self.current_job = job
         
-        if job['type'] == "install":
-            job['application']._install(job['callback'], **job['kwargs'])
-        elif job['type'] == "uninstall":
-            job['application']._uninstall(job['callback'], **job['kwargs'])
-        elif job['type'] == "upgrade":
-            job['application']._upgrade(job['callback'], **job['kwargs'])
+        # La configuration a pu être modifiée par une autre instance
+        self.database._check_config_version()
+        
+        try:
+            if job['type'] == "install":
+                job['application']._install(job['callback'], **job['kwargs'])
+            elif job['type'] == "uninstall":
+                job['application']._uninstall(job['callback'], **job['kwargs'])
+            elif job['type'] == "upgrade":
+                job['application']._upgrade(job['callback'], **job['kwargs'])
+        except:
+            type, value, tb = sys.exc_info()
+            self.current_job = None
+            
+            # L'opération a pu être interrompue après avoir modifié les
+            # fichiers de l'application
+            try:
+                self.database.refresh_installed_application(job['application'].id)
+            except Exception:
+                logger.exception(u"Impossible de mettre à jour l'état de l'application %s." % job['application'].id)
+            
+            # L'erreur de l'opération est transmise, et non celle de la mise
+            # à jour de l'état
+            raise type, value, tb
         
         self.current_job = None
         
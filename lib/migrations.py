@@ -0,0 +1,199 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger('synapps')
+
+import os.path
+
+from iconstore import IconStore
+from functions import version_key
+
+def get_columns(database, table):
+    """
+        Renvoie : La liste des colonnes de la table
+    """
+    return [i['name'] for i in database._query("PRAGMA table_info(%s)" % table)]
+
+def table_exists(database, name):
+    """
+        Renvoie : True si la table (ou l'index) existe, False sinon
+    """
+    return len(database._query("SELECT name FROM sqlite_master WHERE name = ?",
+                               (name,))) > 0
+
+def add_repository_index_columns(database):
+    """Ajoute les en-têtes HTTP et le fichier d'index à la table repositories"""
+    columns = get_columns(database, 'repositories')
+    if 'etag' not in columns:
+        database.curseur.execute("ALTER TABLE repositories ADD COLUMN etag TEXT DEFAULT ''")
+    if 'last_modified' not in columns:
+        database.curseur.execute("ALTER TABLE repositories ADD COLUMN last_modified TEXT DEFAULT ''")
+    if 'index_file' not in columns:
+        database.curseur.execute("ALTER TABLE repositories ADD COLUMN index_file TEXT DEFAULT ''")
+
+def add_icon_files(database):
+    """Crée l'index des icônes et y range les icônes déjà téléchargées"""
+    if not table_exists(database, 'icon_files'):
+        database.curseur.execute("CREATE TABLE icon_files ("
+            "hash TEXT PRIMARY KEY UNIQUE,"
+            "uri TEXT,"
+            "size INT,"
+            "last_access INT)")
+        IconStore(database, './cache/icons').import_directory()
+
+def add_category_counts(database):
+    """Calcule le nombre d'applications par catégorie"""
+    if not table_exists(database, 'category_counts'):
+        database.curseur.execute("CREATE TABLE category_counts ("
+            "category TEXT PRIMARY KEY UNIQUE,"
+            "count INT)")
+        
+        counts = {}
+        for category, count in database._query("SELECT category, COUNT(*) "
+                "FROM applications GROUP BY category"):
+            # Les applications sont comptées dans la catégorie et ses parents
+            while True:
+                counts[category] = counts.get(category, 0) + count
+                if category == '':
+                    break
+                category = os.path.dirname(category)
+        database.curseur.executemany("INSERT INTO category_counts (category, count) "
+                "VALUES (?, ?)", counts.items())
+
+def add_indexes(database):
+    """Crée les index secondaires"""
+    database._create_indexes(['applications_category', 'links_application',
+                              'depends_application', 'depends_depend',
+                              'recommendations_repository'])
+
+def add_version_key(database):
+    """Ajoute la clé de tri des versions à la table applications"""
+    if 'version_key' not in get_columns(database, 'applications'):
+        database.curseur.execute("ALTER TABLE applications ADD COLUMN version_key TEXT")
+    database.curseur.executemany("UPDATE applications SET version_key = ? "
+            "WHERE rowid = ?", [(version_key(version), rowid) for rowid, version
+            in database._query("SELECT rowid, version FROM applications")])
+    database._create_indexes(['applications_version'])
+
+def add_search_index(database):
+    """Crée l'index de recherche plein texte"""
+    if not table_exists(database, 'applications_fts'):
+        if database._create_search_index() != None:
+            database.curseur.execute("INSERT INTO applications_fts (applications_fts) "
+                    "VALUES ('rebuild')")
+
+def add_fuzzy_index(database):
+    """Crée l'index des trigrammes (recherche approximative)"""
+    if not table_exists(database, 'fuzzy_terms'):
+        database.curseur.execute("CREATE TABLE fuzzy_terms ("
+            "id INTEGER PRIMARY KEY,"
+            "application TEXT,"
+            "trigrams INT)")
+        database.curseur.execute("CREATE TABLE fuzzy_trigrams ("
+            "trigram TEXT,"
+            "term INT,"
+            "PRIMARY KEY (trigram, term))")
+        database._update_fuzzy_index()
+
+def add_category_tree(database):
+    """Ajoute le parent de chaque catégorie et la table de leurs ancêtres"""
+    if 'parent' not in get_columns(database, 'categories'):
+        database.curseur.execute("ALTER TABLE categories ADD COLUMN parent TEXT")
+    database.curseur.executemany("UPDATE categories SET parent = ? WHERE id = ?",
+            [(os.path.dirname(id) if id else None, id) for (id,)
+             in database._query("SELECT id FROM categories")])
+    database._create_indexes(['categories_parent'])
+    
+    if not table_exists(database, 'category_tree'):
+        database.curseur.execute("CREATE TABLE category_tree ("
+            "ancestor TEXT,"
+            "descendant TEXT,"
+            "PRIMARY KEY (ancestor, descendant))")
+    database._update_category_tree()
+    database._update_category_counts()
+
+def add_installed(database):
+    """Crée l'index des applications installées"""
+    if not table_exists(database, 'installed'):
+        database.curseur.execute("CREATE TABLE installed ("
+            "id TEXT PRIMARY KEY UNIQUE,"
+            "root TEXT,"
+            "stamp TEXT)")
+    # Les applications installées seront lues à la prochaine mise à jour
+    for table in ['applications', 'depends', 'links', 'icons']:
+        database.curseur.execute("DELETE FROM %s WHERE repository = ''" % table)
+
+def add_manifest(database):
+    """Crée la table des fichiers installés par chaque application"""
+    if not table_exists(database, 'manifest'):
+        database.curseur.execute("CREATE TABLE manifest ("
+            "application TEXT,"
+            "path TEXT,"
+            "size INT,"
+            "crc INT,"
+            "PRIMARY KEY (application, path))")
+    database._create_indexes(['manifest_path'])
+
+def add_installed_as(database):
+    """Ajoute l'option InstalledAs à l'index des applications installées"""
+    if 'installed_as' not in get_columns(database, 'installed'):
+        database.curseur.execute("ALTER TABLE installed ADD COLUMN installed_as TEXT")
+    # Les applications installées seront lues à nouveau à la prochaine mise à
+    # jour
+    database.curseur.execute("UPDATE installed SET stamp = NULL")
+
+def add_fuzzy_term_index(database):
+    """Indexe les trigrammes par terme"""
+    database._create_indexes(['fuzzy_trigrams_term'])
+
+# Migrations, dans l'ordre : la base de donnée est à la version n lorsque les
+# n premières migrations ont été appliquées. Les migrations ne doivent rien
+# supposer du contenu de la base, qui a pu être créée par n'importe quelle
+# version précédente.
+MIGRATIONS = [
+    add_repository_index_columns,
+    add_icon_files,
+    add_category_counts,
+    add_indexes,
+    add_version_key,
+    add_search_index,
+    add_fuzzy_index,
+    add_category_tree,
+    add_installed,
+    add_manifest,
+    add_installed_as,
+    add_fuzzy_term_index,
+]
+
+# Version du schéma créé par database.__init__
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_version(database):
+    """
+        Renvoie : La version du schéma de la base de donnée
+    """
+    return database._query("PRAGMA user_version")[0][0]
+
+def set_version(database, version):
+    """Enregistre la version du schéma de la base de donnée"""
+    database.curseur.execute("PRAGMA user_version = %d" % version)
+
+def upgrade(database):
+    """
+        Applique les migrations qui ne l'ont pas encore été
+        
+        Arguments :
+            database : Base de donnée
+    """
+    version = get_version(database)
+    for i, migration in enumerate(MIGRATIONS[version:], version + 1):
+        logger.debug(u"Migration de la base de donnée vers la version %d (%s)." % (i, migration.__name__))
+        try:
+            migration(database)
+            database.connection.commit()
+        except:
+            database.connection.rollback()
+            raise
+        set_version(database, i)
@@ -0,0 +1,169 @@
+#!/usr/bin/python2
+# -*- coding: utf-8 -*-
+
+import logging
+
+logger = logging.getLogger('synapps')
+
+from ConfigParser import RawConfigParser, MissingSectionHeaderError, ParsingError
+
+# Icônes que peut fournir une application
+ICON_SIZES = [32, 48, 64, 128]
+
+# Sections du dépôt qui ne décrivent pas une application
+SPECIAL_SECTIONS = ['repository', 'categories', 'categories_hash']
+
+def getlist(options, option):
+    """
+        Arguments :
+            options : dictionnaire des options d'une section
+            option : nom de l'option, contenant %d (par exemple 'depend%d')
+        
+        Renvoie : la liste des valeurs des options option % 1, option % 2...
+    """
+    i = 1
+    l = []
+    while option % (i,) in options:
+        l.append(options[option % (i,)])
+        i += 1
+    return l
+
+class RepositoryParser(object):
+    """
+        Lecture en une seule passe du fichier d'index d'un dépôt
+        (repository.ini), sans construire d'objet ConfigParser.
+        
+        Le parcours de l'objet renvoie les applications au fur et à mesure de
+        la lecture, sous la forme de tuples (infos, links, depends, icons) :
+            infos : tuple (id, branch, repository, category, name,
+                    friendly_name, short_description, long_description, size_c,
+                    size_u, version, license, author, show, uri)
+            links : liste de tuples (title, uri)
+            depends : liste des identifiants des dépendances
+            icons : liste de tuples (size, uri, hash)
+        
+        Les sections [repository], [categories] et [categories_hash] sont
+        disponibles (méthode get et attribut recommendations) une fois le
+        fichier entièrement lu.
+        
+        La syntaxe acceptée est celle de RawConfigParser (noms d'options
+        insensibles à la casse, valeurs sur plusieurs lignes, commentaires).
+        Une section d'application répétée est renvoyée une nouvelle fois (voir
+        get_repository_cfg).
+    """
+    def __init__(self, fp, repository):
+        """
+            Arguments :
+                fp : Objet fichier (unicode) contenant l'index du dépôt
+                repository : Adresse du dépôt
+        """
+        self.fp = fp
+        self.repository = repository
+        self.sections = dict((i, {}) for i in SPECIAL_SECTIONS)
+    
+    def __iter__(self):
+        section = None
+        options = None
+        option = None
+        
+        for lineno, line in enumerate(self.fp, 1):
+            if line[:1] in '#;' or not line.strip():
+                # Commentaire ou ligne vide
+                continue
+            if line[0] in 'rR' and line.split(None, 1)[0].lower() == 'rem':
+                # Commentaire
+                continue
+            
+            if line[0].isspace() and option != None:
+                # Suite de la valeur de l'option précédente
+                value = line.strip()
+                if value:
+                    options[option] = options[option] + '\n' + value
+                continue
+            
+            match = RawConfigParser.SECTCRE.match(line)
+            if match:
+                if section != None:
+                    application = self._get_application(section, options)
+                    if application != None:
+                        yield application
+                
+                section = match.group('header')
+                options = self.sections.get(section, {})
+                option = None
+                continue
+            
+            if section == None:
+                raise MissingSectionHeaderError(getattr(self.fp, 'name', '<???>'), lineno, line)
+            
+            match = RawConfigParser.OPTCRE.match(line)
+            if not match:
+                error = ParsingError(getattr(self.fp, 'name', '<???>'))
+                error.append(lineno, repr(line))
+                raise error
+            
+            option, vi, value = match.group('option', 'vi', 'value')
+            if vi in ('=', ':') and ';' in value:
+                # Commentaire en fin de ligne
+                pos = value.find(';')
+                if pos != -1 and value[pos-1].isspace():
+                    value = value[:pos]
+            value = value.strip()
+            if value == '""':
+                value = ''
+            option = option.rstrip().lower()
+            options[option] = value
+        
+        if section != None:
+            application = self._get_application(section, options)
+            if application != None:
+                yield application
+    
+    def _get_application(self, section, options):
+        """
+            Renvoie : Le tuple (infos, links, depends, icons) de l'application
+                      décrite par la section, None si la section ne décrit pas
+                      une application ou si elle est incomplète
+        """
+        if section in self.sections:
+            return None
+        
+        try:
+            branch, id = section.split(':', 1)
+            
+            show = options['show']
+            if show.lower() not in RawConfigParser._boolean_states:
+                raise ValueError('Not a boolean: %s' % show)
+            
+            infos = (id, branch, self.repository, options['category'],
+                     options['name'], options['friendly_name'],
+                     options['short_description'], options['long_description'],
+                     int(options['size_c']), int(options['size_u']),
+                     options['version'], options['license'], options['author'],
+                     RawConfigParser._boolean_states[show.lower()],
+                     options['uri'])
+            
+            links = zip(getlist(options, 'link%d_name'), getlist(options, 'link%d'))
+            depends = getlist(options, 'depend%d')
+            icons = [(size, options['icon_%d' % size], options['icon_%d_hash' % size])
+                     for size in ICON_SIZES if 'icon_%d' % size in options]
+        except (KeyError, ValueError):
+            logger.warning(u"Les informations de l'application %s du dépôt %s sont incomplète." % (section, self.repository))
+            return None
+        
+        return infos, links, depends, icons
+    
+    def get(self, section, option, default=None):
+        """
+            Renvoie : La valeur de l'option d'une des sections [repository],
+                      [categories] ou [categories_hash], default si elle
+                      n'existe pas
+        """
+        return self.sections[section].get(option.lower(), default)
+    
+    @property
+    def recommendations(self):
+        """
+            Renvoie : La liste des applications recommandées par le dépôt
+        """
+        return getlist(self.sections['repository'], 'recommendation%d')
@@ -72,7 +72,9 @@ def main():
     
     db = database()
     logger.debug(u"Version : %s" % db.get_config("version"))
+    db.check_indexes()
     db.update(force=True)
+    db.close()
     
     return 0
 